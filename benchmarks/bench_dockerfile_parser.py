@@ -0,0 +1,64 @@
+# Micro-benchmark of the Dockerfile FROM line parsing over a synthetic corpus.
+# Compares the per-file regexes the scan used before (patterns rebuilt for every file and registry) with
+# dockerfile_parser.parse_images.
+#   python benchmarks/bench_dockerfile_parser.py [number of Dockerfiles]
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import dockerfile_parser  # noqa: E402
+
+image_langs = ['alpine', 'dotnet', 'golang', 'java', 'jdk', 'jre', 'node', 'php', 'python']
+registries = ['redventures-container-pipeline-docker.jfrog.io', '089022728777.dkr.ecr.us-east-1.amazonaws.com']
+
+base_images = [
+    'python:3.9-slim', 'node:14-alpine', 'golang:1.16', 'openjdk:11-jre', 'php:7.4-fpm-alpine', 'alpine:3.14',
+    'mcr.microsoft.com/dotnet/aspnet:5.0', 'nginx:1.21', 'ubuntu:20.04',
+    'redventures-container-pipeline-docker.jfrog.io/rv-python-3.8:1.4.2',
+    '089022728777.dkr.ecr.us-east-1.amazonaws.com/rv-node-14:2.0.1',
+    'python@sha256:3f1a2b3c4d5e6f', '${BASE_IMAGE}:${BASE_TAG}',
+]
+
+
+def dockerfile(rng):
+    lines = ['# syntax=docker/dockerfile:1', 'ARG BASE_IMAGE=python', 'ARG BASE_TAG=3.10']
+    for stage in range(rng.randint(1, 3)):
+        platform = '--platform=$BUILDPLATFORM ' if rng.random() < 0.2 else ''
+        lines.append(f'FROM {platform}{rng.choice(base_images)} AS stage{stage}')
+        lines.append('WORKDIR /app')
+        lines.append('COPY . .')
+        for _ in range(rng.randint(5, 30)):
+            lines.append(f'RUN echo {rng.random()} && \\\n    apt-get install -y package{rng.randint(0, 100)}')
+        lines.append('ENV PORT=8080')
+    lines.append('FROM stage0')
+    lines.append('CMD ["./run"]')
+    return '\n'.join(lines) + '\n'
+
+
+def legacy(content):
+    images = []
+    for registry in registries:
+        images.extend(set(re.findall(rf"(^FROM.*)({registry}.*)(:)([^\s]+)", content, re.MULTILINE)))
+    pattern = r'\b({})\b'.format('|'.join(map(re.escape, image_langs)))
+    images.extend(set(re.findall(rf"(^FROM )(.*{pattern}.*)(:)([^\s]+)", content, re.MULTILINE)))
+    return images
+
+
+def run(name, parse, corpus):
+    start = time.perf_counter()
+    found = sum(len(parse(content)) for content in corpus)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<20} {elapsed * 1000:8.1f} ms  {len(corpus) / elapsed:10.0f} files/s  {found} images")
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rng = random.Random(42)
+    corpus = [dockerfile(rng) for _ in range(count)]
+    print(f"{count} Dockerfiles, {sum(map(len, corpus)) / 1024 / 1024:.1f} MB")
+    for _ in range(3):
+        run('legacy regexes', legacy, corpus)
+        run('dockerfile_parser', dockerfile_parser.parse_images, corpus)
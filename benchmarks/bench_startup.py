@@ -0,0 +1,66 @@
+# Cold start benchmark of the Lambda handler: import time of lambda_function, of the scan modules each run_function
+# imports, and init time of the clients created on first use (boto3 clients, PyGithub login). Every sample runs in a
+# fresh interpreter like a cold Lambda container. No request is sent, the SSM parameters aren't fetched.
+#   python benchmarks/bench_startup.py [number of samples]
+import statistics
+import time
+import subprocess
+import json
+import sys
+import os
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+ENVIRONMENT = {
+    'db_table': 'metrics', 'db_endpoint': 'localhost', 'db_name': 'postgres', 'db_user': 'postgres',
+    'db_pass': '/database/db_pass', 'db_port': '5432', 'sns_topic': 'arn:aws:sns:us-east-1:123456789012:alerts',
+    'github_token': '/github_token', 'image_lang_list': 'alpine, dotnet, golang, java, jdk, jre, node, php, python',
+    'AWS_DEFAULT_REGION': 'us-east-1', 'AWS_ACCESS_KEY_ID': 'benchmark', 'AWS_SECRET_ACCESS_KEY': 'benchmark',
+}
+
+SAMPLE = '''
+import json, sys, time
+timings = {}
+start = time.perf_counter()
+import lambda_function
+timings['import lambda_function'] = time.perf_counter() - start
+for module in sys.argv[1:]:
+    start = time.perf_counter()
+    __import__(module)
+    timings[f'import {module}'] = time.perf_counter() - start
+import secrets_cache
+for service in ('ssm', 'sns', 's3'):
+    start = time.perf_counter()
+    secrets_cache.client(service)
+    timings[f'init {service} client'] = time.perf_counter() - start
+import enrichment
+start = time.perf_counter()
+enrichment.thread_github('benchmark')
+timings['init Github client'] = time.perf_counter() - start
+print(json.dumps(timings))
+'''
+
+# Modules imported by each run_function on top of lambda_function
+RUN_FUNCTIONS = {
+    'metrics_all': ['scan_engine'],
+    'pipeline_metrics_all': ['pipeline_metrics_all'],
+    'non_pipeline_metrics': ['non_pipeline_metrics'],
+}
+
+
+def sample(modules):
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', SAMPLE] + modules, cwd=ROOT, env=dict(os.environ, **ENVIRONMENT),
+                            check=True, capture_output=True, text=True).stdout
+    timings = json.loads(output.splitlines()[-1])
+    timings['interpreter total'] = time.perf_counter() - start
+    return timings
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for run_function, modules in RUN_FUNCTIONS.items():
+        samples = [sample(modules) for _ in range(count)]
+        print(f"{run_function} ({count} cold starts, median)")
+        for name in samples[0]:
+            print(f"  {name:<36} {statistics.median(s[name] for s in samples) * 1000:8.1f} ms")
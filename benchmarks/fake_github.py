@@ -0,0 +1,247 @@
+# Local stand-in for the Github API serving a synthetic org, so the scan can run without a token or rate limit.
+# Serves the endpoints the scan uses (code search with the org:/repo:/size:/path:/filename: qualifiers, repositories,
+# orgs, contents, contributors, rate limit and the GraphQL batch queries of github_graphql) and counts the requests.
+#   python benchmarks/fake_github.py [number of Dockerfiles] [port]
+# then point github_base_url to http://127.0.0.1:<port>
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import threading
+import random
+import base64
+import hashlib
+import json
+import time
+import sys
+import re
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_dockerfile_parser import dockerfile  # noqa: E402
+
+ORG = 'synthetic-org'
+# Org without a display name (organization.name is null), a few repositories belong to it
+UNNAMED_ORG = 'unnamed-org'
+ORG_NAMES = {ORG: 'Synthetic Org', UNNAMED_ORG: None}
+# User owning a few repositories (no organization)
+USER = 'solo-dev'
+# Code search never returns more than 1000 results for a query, the scan has to partition bigger searches
+SEARCH_RESULT_LIMIT = 1000
+DIRECTORIES = ['', 'docker/', 'deploy/', 'services/api/', 'services/worker/', 'build/ci/']
+QUALIFIER = re.compile(r'(\w+):("[^"]*"|\S+)')
+PHRASE = re.compile(r'"([^"]*)"')
+NON_WORD = re.compile(r'[^a-z0-9]+')
+GRAPHQL_REPOSITORY = re.compile(r'(r\d+): repository\(owner: ("(?:[^"\\]|\\.)*"), name: ("(?:[^"\\]|\\.)*")\)')
+GRAPHQL_OBJECT = re.compile(r'(f\d+): object\(expression: ("(?:[^"\\]|\\.)*")\)')
+
+
+def words(text):
+    # Code search matches terms, not punctuation: "us east 1" finds us-east-1
+    return ' ' + NON_WORD.sub(' ', text.lower()).strip() + ' '
+
+
+def synthetic_org(files, seed=42):
+    # files Dockerfiles over files / 10 repositories (a few archived, one in 50 in UNNAMED_ORG, one in 50 owned by USER
+    # and one in 50 deleted but still in the search index), each repository has Dockerfiles in a few of the usual
+    # directories
+    rng = random.Random(seed)
+    repositories = {}
+    dockerfiles = []
+    repository_count = max(1, files // 10)
+    for i in range(files):
+        name = f"service-{i % repository_count:04d}"
+        owner = {7: UNNAMED_ORG, 23: USER}.get(i % repository_count % 50, ORG)
+        full_name = f"{owner}/{name}"
+        if full_name not in repositories:
+            repositories[full_name] = {'name': name, 'full_name': full_name, 'owner': owner,
+                                       'archived': rng.random() < 0.05,
+                                       'deleted': i % repository_count % 50 == 31,
+                                       'contributors': [f"dev{rng.randint(0, 50)}" for _ in range(5)] + ['rv-bot']}
+        path = f"{DIRECTORIES[(i // repository_count) % len(DIRECTORIES)]}Dockerfile"
+        if i // repository_count >= len(DIRECTORIES):
+            path = f"apps/app{i // repository_count}/Dockerfile"
+        content = dockerfile(rng).encode()
+        dockerfiles.append({'full_name': full_name, 'path': path, 'content': content, 'size': len(content),
+                            'sha': hashlib.sha1(b'blob %d\0' % len(content) + content).hexdigest(),
+                            'words': words(content.decode())})
+    return repositories, dockerfiles
+
+
+class FakeGithub:
+    def __init__(self, files):
+        self.repositories, self.dockerfiles = synthetic_org(files)
+        self.files = {(d['full_name'], d['path']): d for d in self.dockerfiles}
+        self.calls = {}
+        self.bytes_sent = 0
+        # Results of every query, the pages of a search are requested one by one
+        self.searches = {}
+        self.lock = threading.Lock()
+
+    def count(self, endpoint, size=0):
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            self.bytes_sent += size
+
+    def search(self, query):
+        if query not in self.searches:
+            self.searches[query] = self.matches(query)
+        return self.searches[query]
+
+    def matches(self, query):
+        qualifiers = dict(QUALIFIER.findall(query))
+        phrases = [words(phrase) for phrase in PHRASE.findall(QUALIFIER.sub('', query))]
+        low, high = 0, float('inf')
+        if 'size' in qualifiers:
+            low, _, high = qualifiers['size'].partition('..')
+            low, high = int(low), int(high)
+        results = []
+        for d in self.dockerfiles:
+            if 'org' in qualifiers and not d['full_name'].startswith(qualifiers['org'] + '/'):
+                continue
+            if 'repo' in qualifiers and d['full_name'] != qualifiers['repo']:
+                continue
+            if 'filename' in qualifiers and d['path'].rsplit('/', 1)[-1] != qualifiers['filename']:
+                continue
+            if 'path' in qualifiers:
+                path = qualifiers['path'].strip('/')
+                directory = d['path'].rsplit('/', 1)[0] if '/' in d['path'] else ''
+                if not (directory == path or directory.startswith(path + '/')):
+                    continue
+            if not low <= d['size'] <= high:
+                continue
+            if all(phrase in d['words'] for phrase in phrases):
+                results.append(d)
+        return results
+
+    def repository_json(self, base, full_name):
+        repository = self.repositories[full_name]
+        owner = repository['owner']
+        return {'id': abs(hash(full_name)) % 10 ** 8, 'name': repository['name'], 'full_name': full_name,
+                'archived': repository['archived'], 'html_url': f"https://github.com/{full_name}",
+                'url': f"{base}/repos/{full_name}", 'owner': {'login': owner, 'url': f"{base}/users/{owner}"},
+                'organization': {'login': owner, 'url': f"{base}/orgs/{owner}"} if owner in ORG_NAMES else None}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeGithub'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, endpoint):
+        data = json.dumps(body).encode()
+        self.server.github.count(endpoint, len(data))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('X-RateLimit-Limit', '1000000')
+        self.send_header('X-RateLimit-Remaining', '999999')
+        self.send_header('X-RateLimit-Reset', str(int(time.time()) + 3600))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def page(self, items, query):
+        per_page = int(query.get('per_page', ['30'])[0])
+        page = int(query.get('page', ['1'])[0])
+        return items[(page - 1) * per_page:page * per_page], page, per_page
+
+    def do_GET(self):
+        github = self.server.github
+        base = f"http://{self.headers['Host']}"
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split('/') if part]
+
+        if parts == ['_stats']:
+            return self.send(200, {'calls': github.calls, 'bytes_sent': github.bytes_sent}, '_stats')
+        if parts == ['rate_limit']:
+            rate = {'limit': 1000000, 'remaining': 999999, 'reset': int(time.time()) + 3600, 'used': 1}
+            return self.send(200, {'resources': {'core': rate, 'search': rate, 'graphql': rate}, 'rate': rate},
+                             'rate_limit')
+        if parts == ['search', 'code']:
+            results = github.search(query['q'][0])
+            items, page, per_page = self.page(results, query)
+            if (page - 1) * per_page >= SEARCH_RESULT_LIMIT:
+                return self.send(422, {'message': 'Only the first 1000 search results are available'}, 'search')
+            return self.send(200, {'total_count': len(results), 'incomplete_results': False, 'items': [
+                {'name': d['path'].rsplit('/', 1)[-1], 'path': d['path'], 'sha': d['sha'],
+                 'url': f"{base}/repos/{d['full_name']}/contents/{d['path']}",
+                 'repository': github.repository_json(base, d['full_name']), 'score': 1.0} for d in items]}, 'search')
+        if len(parts) == 2 and parts[0] == 'orgs':
+            if parts[1] not in ORG_NAMES:
+                return self.send(404, {'message': 'Not Found'}, 'orgs')
+            return self.send(200, {'login': parts[1], 'name': ORG_NAMES[parts[1]], 'url': f"{base}/orgs/{parts[1]}"},
+                             'orgs')
+        if len(parts) == 3 and parts[0] == 'orgs' and parts[2] == 'repos':
+            names = sorted(name for name, repository in github.repositories.items()
+                           if name.startswith(parts[1] + '/') and not repository['deleted'])
+            items, page, per_page = self.page(names, query)
+            return self.send(200, [github.repository_json(base, name) for name in items], 'org_repos')
+        if len(parts) >= 3 and parts[0] == 'repos':
+            full_name = f"{parts[1]}/{parts[2]}"
+            if full_name not in github.repositories or github.repositories[full_name]['deleted']:
+                return self.send(404, {'message': 'Not Found'}, 'repos')
+            if len(parts) == 3:
+                return self.send(200, github.repository_json(base, full_name), 'repos')
+            if parts[3] == 'contributors':
+                contributors = github.repositories[full_name]['contributors']
+                items, page, per_page = self.page(contributors, query)
+                return self.send(200, [{'login': login, 'contributions': 1} for login in items], 'contributors')
+            if parts[3] == 'contents':
+                path = '/'.join(parts[4:])
+                d = github.files.get((full_name, path))
+                if d is None:
+                    directories = sorted({p.split('/')[0] for (name, p) in github.files if name == full_name and '/' in p})
+                    if path == '':
+                        return self.send(200, [{'type': 'dir', 'name': directory, 'path': directory}
+                                               for directory in directories], 'contents')
+                    return self.send(404, {'message': 'Not Found'}, 'contents')
+                return self.send(200, {'type': 'file', 'encoding': 'base64', 'name': path.rsplit('/', 1)[-1],
+                                       'path': path, 'sha': d['sha'], 'size': d['size'],
+                                       'content': base64.b64encode(d['content']).decode()}, 'contents')
+        return self.send(404, {'message': 'Not Found'}, 'not_found')
+
+    def do_POST(self):
+        github = self.server.github
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if urlparse(self.path).path.rstrip('/') != '/graphql':
+            return self.send(404, {'message': 'Not Found'}, 'not_found')
+        # Only understands the aliased queries built by github_graphql.batch_query
+        query = body['query']
+        repositories = list(GRAPHQL_REPOSITORY.finditer(query))
+        data = {}
+        for i, match in enumerate(repositories):
+            end = repositories[i + 1].start() if i + 1 < len(repositories) else len(query)
+            fields = query[match.end():end]
+            full_name = f"{json.loads(match.group(2))}/{json.loads(match.group(3))}"
+            if full_name not in github.repositories or github.repositories[full_name]['deleted']:
+                data[match.group(1)] = None
+                continue
+            repository = github.repositories[full_name]
+            result = {}
+            if 'isArchived' in fields:
+                result.update({'isArchived': repository['archived'], 'name': repository['name'],
+                               'url': f"https://github.com/{full_name}",
+                               # ... on Organization { name } only matches orgs
+                               'owner': {'login': repository['owner']} if repository['owner'] not in ORG_NAMES else
+                                        {'login': repository['owner'], 'name': ORG_NAMES[repository['owner']]}})
+            for alias, expression in GRAPHQL_OBJECT.findall(fields):
+                d = github.files.get((full_name, json.loads(expression)[len('HEAD:'):]))
+                result[alias] = None if d is None else {'text': d['content'].decode(), 'isTruncated': False}
+            data[match.group(1)] = result
+        return self.send(200, {'data': data}, 'graphql')
+
+
+def serve(files, port=0):
+    # Starts the server in a background thread, returns it (server.server_address has the port)
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.github = FakeGithub(files)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    server = serve(int(sys.argv[1]) if len(sys.argv) > 1 else 3000, int(sys.argv[2]) if len(sys.argv) > 2 else 8123)
+    print(f"Serving {len(server.github.dockerfiles)} Dockerfiles of {ORG} on http://127.0.0.1:{server.server_address[1]}")
+    threading.Event().wait()
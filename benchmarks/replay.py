@@ -0,0 +1,172 @@
+# Offline replay of a whole scan against the local Github stand-in (benchmarks/fake_github.py): Dockerfiles/s, API
+# calls per Dockerfile, peak memory and db load time, without a Github token, SSM or RDS.
+# With --postgres the Lambda handler runs end to end against a local Postgres (COPY, upsert and rollups), otherwise
+# the rows are scanned into a CSV file and loaded into SQLite. --runs 2 shows the warm runs (repository cache and file
+# index filled by the first run).
+# --fan-out org|partition runs the scan in local worker processes (see fan_out), the scan time is then the fan out time.
+#   python benchmarks/replay.py [--files 3000] [--backend rest|graphql] [--runs 2] [--postgres /tmp:5433:postgres]
+#                               [--fan-out org|partition]
+from multiprocessing import Process, Queue
+from contextlib import redirect_stdout
+import urllib.request
+import tempfile
+import argparse
+import shutil
+import resource
+import sqlite3
+import logging
+import json
+import time
+import csv
+import sys
+import os
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_github  # noqa: E402
+
+TABLE = 'replay_metrics'
+# The org without a display name too
+ORG_LIST = f"{fake_github.ORG}, {fake_github.UNNAMED_ORG}"
+# Seconds spent in the wrapped functions during the current run
+timings = {}
+
+
+def run_server(files, ports):
+    server = fake_github.serve(files)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def api_calls(base_url):
+    with urllib.request.urlopen(f"{base_url}/_stats") as response:
+        stats = json.load(response)
+    calls = stats['calls']
+    calls.pop('_stats', None)
+    return calls
+
+
+def timed(module, name):
+    # Adds the time spent in module.name to timings[name]
+    function = getattr(module, name)
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+    setattr(module, name, wrapper)
+
+
+def sqlite_load(path, database):
+    # Same primary key as the db table, rows already loaded are skipped
+    import loader
+    import row_sink
+    db = sqlite3.connect(database)
+    db.execute(f"CREATE TABLE IF NOT EXISTS {TABLE} ({', '.join(row_sink.FIELDS)}, "
+               f"PRIMARY KEY ({', '.join(loader.PRIMARY_KEY)}))")
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        db.executemany(f"INSERT OR IGNORE INTO {TABLE} VALUES ({', '.join('?' * len(row_sink.FIELDS))})", reader)
+    db.commit()
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=3000, help="Dockerfiles in the synthetic org")
+    parser.add_argument('--backend', default='rest', choices=['rest', 'graphql'])
+    parser.add_argument('--runs', type=int, default=2)
+    parser.add_argument('--concurrency', default='5', help="github_concurrency")
+    parser.add_argument('--postgres', help="host:port:dbname of a local Postgres (user postgres, no password)")
+    parser.add_argument('--fan-out', choices=['org', 'partition'], help="fan out the scan to local worker processes "
+                                                                       "(with --postgres)")
+    args = parser.parse_args()
+
+    ports = Queue()
+    server = Process(target=run_server, args=(args.files, ports), daemon=True)
+    server.start()
+    base_url = f"http://127.0.0.1:{ports.get(timeout=60)}"
+    workdir = tempfile.mkdtemp(prefix='replay-')
+
+    host, port, dbname = (args.postgres or '/tmp:5432:postgres').split(':')
+    os.environ.update({
+        'github_base_url': base_url, 'github_token': '/replay/github_token', 'github_concurrency': args.concurrency,
+        'image_lang_list': 'alpine, dotnet, golang, java, jdk, jre, node, php, python',
+        'cache_path': os.path.join(workdir, 'cache.db'), 'partial_dir': os.path.join(workdir, 'partials'), 'cache_bucket': '', 'checkpoint_bucket': '',
+        'db_table': TABLE, 'db_endpoint': host, 'db_port': port, 'db_name': dbname, 'db_user': 'postgres',
+        'db_pass': '/replay/db_pass', 'sns_topic': 'replay', 'AWS_DEFAULT_REGION': 'us-east-1',
+    })
+    logging.basicConfig(level=logging.WARNING)
+    import secrets_cache
+    # The parameters the handler would fetch from SSM
+    secrets_cache.parameters['/replay/github_token'] = ('replay', time.time())
+    secrets_cache.parameters['/replay/db_pass'] = ('', time.time())
+    import lambda_function
+    import scan_engine
+    import checkpoint
+    import loader
+    import instrumentation
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.postgres:
+        import db_connection
+        with db_connection.transaction() as cur:
+            cur.execute(f"DROP VIEW IF EXISTS {TABLE}_latest")
+            cur.execute(f"DROP TABLE IF EXISTS {TABLE}, {TABLE}_daily CASCADE")
+
+    for module, name in ((scan_engine, 'scan'), (loader, 'upsert'), (loader, 'refresh_rollups')):
+        timed(module, name)
+
+    print(f"{args.files} Dockerfiles, backend {args.backend}, github_concurrency {args.concurrency}, "
+          f"{'Postgres' if args.postgres else 'SQLite'}{f', fan out per {args.fan_out}' if args.fan_out else ''}")
+    for run in range(1, args.runs + 1):
+        # Every run is a new scan (a complete checkpoint would skip it)
+        checkpoint.CHECKPOINT_DIR = os.path.join(workdir, f"checkpoints-{run}")
+        timings.clear()
+        instrumentation.reset()
+        calls_before = api_calls(base_url)
+
+        start = time.perf_counter()
+        # The scan prints every search and page range
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            if args.postgres:
+                event = {'run_function': 'metrics_all', 'org_list': ORG_LIST, 'fetch_backend': args.backend}
+                if args.fan_out:
+                    event['fan_out'] = args.fan_out
+                result = lambda_function.main(event, None)
+            else:
+                path = os.path.join(workdir, 'output.csv')
+                sink = scan_engine.row_sink.CsvSink(path)
+                result = scan_engine.search_github(lambda_function.PIPELINE_KEYWORDS, ORG_LIST, sink=sink,
+                                                   backend=args.backend)
+                sink.close()
+        if not args.postgres:
+            load_start = time.perf_counter()
+            sqlite_load(path, os.path.join(workdir, 'metrics.db'))
+            timings['upsert'] = time.perf_counter() - load_start
+        total = time.perf_counter() - start
+
+        calls_after = api_calls(base_url)
+        calls = {endpoint: calls_after.get(endpoint, 0) - calls_before.get(endpoint, 0) for endpoint in calls_after}
+        calls = {endpoint: count for endpoint, count in calls.items() if count}
+        files = result['files_processed']
+        metrics = result.get('metrics') or instrumentation.summary()
+        # The workers of a fan out scan in other processes
+        scan_time = timings.get('scan') or metrics.get('stage.fan_out.time', 0.0)
+        load_time = timings.get('upsert', 0.0) + timings.get('refresh_rollups', 0.0)
+        print(f"run {run}: {files} Dockerfiles, {result['rows']} rows in {total:.2f}s")
+        print(f"  scan           {scan_time:8.2f} s  {files / scan_time if scan_time else 0:10.1f} Dockerfiles/s")
+        print(f"  db load        {load_time:8.3f} s")
+        print(f"  API calls      {sum(calls.values()):8d}    {sum(calls.values()) / max(files, 1):10.2f} per Dockerfile  {calls}")
+        print(f"  metrics        {metrics}")
+        print(f"  peak memory    {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:8.1f} MB (max RSS so far)")
+    server.terminate()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
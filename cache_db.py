@@ -0,0 +1,76 @@
+from botocore.exceptions import ClientError
+import threading
+import logging
+import secrets_cache
+import sqlite3
+import os
+
+logger = logging.getLogger()
+
+# SQLite file shared by repo_cache and file_index. Set cache_path to an empty string to run without it: the file index
+# is turned off and the repository metadata is only kept in memory for the run.
+# /tmp only survives in warm Lambda containers, so when cache_bucket is set the file is pulled from S3 at the start of a
+# run and pushed back at the end for the next (cold) run.
+CACHE_PATH = os.environ.get('cache_path', '/tmp/metrics_cache.db')
+CACHE_BUCKET = os.environ.get('cache_bucket', '')
+CACHE_KEY = os.environ.get('cache_key', 'metrics_cache.db')
+
+# The connection is shared by the worker threads, every access goes through lock
+lock = threading.RLock()
+db = None
+
+
+def connect():
+    global db
+    if db is None and CACHE_PATH:
+        db = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+    return db
+
+
+def execute(sql, params=()):
+    with lock:
+        conn = connect()
+        if conn is not None:
+            conn.execute(sql, params)
+            conn.commit()
+
+
+def executemany(sql, params):
+    with lock:
+        conn = connect()
+        if conn is not None:
+            conn.executemany(sql, params)
+            conn.commit()
+
+
+def query(sql, params=()):
+    with lock:
+        conn = connect()
+        if conn is None:
+            return []
+        return conn.execute(sql, params).fetchall()
+
+
+def pull():
+    if not (CACHE_BUCKET and CACHE_PATH) or os.path.exists(CACHE_PATH):
+        return
+    try:
+        secrets_cache.client('s3').download_file(CACHE_BUCKET, CACHE_KEY, CACHE_PATH)
+        logger.info(f"Downloaded cache s3://{CACHE_BUCKET}/{CACHE_KEY}")
+    except ClientError as e:
+        # No cache yet (first run) or no access, the run just starts cold
+        logger.warning(f"Unable to download cache s3://{CACHE_BUCKET}/{CACHE_KEY}: {e}")
+
+
+def push():
+    if not (CACHE_BUCKET and CACHE_PATH):
+        return
+    with lock:
+        if db is None:
+            return
+        db.commit()
+        try:
+            secrets_cache.client('s3').upload_file(CACHE_PATH, CACHE_BUCKET, CACHE_KEY)
+            logger.info(f"Uploaded cache to s3://{CACHE_BUCKET}/{CACHE_KEY}")
+        except ClientError as e:
+            logger.warning(f"Unable to upload cache to s3://{CACHE_BUCKET}/{CACHE_KEY}: {e}")
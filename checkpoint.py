@@ -0,0 +1,58 @@
+from botocore.exceptions import ClientError
+import hashlib
+import secrets_cache
+import logging
+import json
+import time
+import os
+
+logger = logging.getLogger()
+
+# Scan checkpoints (search/page cursor and the Dockerfiles already processed) are kept in S3 when checkpoint_bucket is
+# set, otherwise in checkpoint_dir. A finished scan keeps its checkpoint (complete) so the next ticks of the schedule
+# don't scan again. A checkpoint older than checkpoint_max_age_hours is ignored so every day starts a fresh snapshot.
+CHECKPOINT_BUCKET = os.environ.get('checkpoint_bucket', '')
+CHECKPOINT_PREFIX = 'checkpoints/'
+CHECKPOINT_DIR = os.environ.get('checkpoint_dir', '/tmp/checkpoints')
+MAX_AGE = float(os.environ.get('checkpoint_max_age_hours', '20')) * 3600
+
+
+def checkpoint_name(event):
+    # One checkpoint per schedule: run_function and the orgs it scans
+    orgs = event.get('org_list', '').replace(' ', '')
+    return f"{event['run_function']}-{hashlib.sha1(orgs.encode()).hexdigest()[:8]}"
+
+
+def load(name):
+    try:
+        if CHECKPOINT_BUCKET:
+            body = secrets_cache.client('s3').get_object(Bucket=CHECKPOINT_BUCKET, Key=f"{CHECKPOINT_PREFIX}{name}.json")['Body'].read()
+        else:
+            with open(os.path.join(CHECKPOINT_DIR, f"{name}.json")) as f:
+                body = f.read()
+    except (ClientError, FileNotFoundError):
+        return None
+    checkpoint = json.loads(body)
+    if time.time() - checkpoint['created'] > MAX_AGE:
+        logger.info(f"Ignoring checkpoint {name} from {time.ctime(checkpoint['created'])}")
+        return None
+    return checkpoint
+
+
+def save(name, checkpoint):
+    body = json.dumps(checkpoint)
+    if CHECKPOINT_BUCKET:
+        secrets_cache.client('s3').put_object(Bucket=CHECKPOINT_BUCKET, Key=f"{CHECKPOINT_PREFIX}{name}.json", Body=body)
+    else:
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        with open(os.path.join(CHECKPOINT_DIR, f"{name}.json"), 'w') as f:
+            f.write(body)
+    if 'units' in checkpoint and checkpoint['units'] is None:
+        # Fan out coordinator stopped while building its units
+        progress = "units not built yet"
+    elif 'units' in checkpoint:
+        # Checkpoint of a fan out coordinator (see fan_out)
+        progress = f"{len(checkpoint['done'])}/{len(checkpoint['units'])} units loaded"
+    else:
+        progress = f"search {checkpoint['search']}, page {checkpoint['page']}"
+    logger.info(f"Saved checkpoint {name}: {progress}, complete: {checkpoint.get('complete', False)}")
@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+import secrets_cache
+import psycopg2
+import logging
+import os
+
+logger = logging.getLogger()
+
+# One connection per warm Lambda container: it is opened by the first invocation and checked (and reopened if the
+# server, the pooler or a frozen container dropped it) by the next ones. db_endpoint can point to an RDS Proxy or
+# pgbouncer endpoint, a load only uses transaction scoped state (SET LOCAL, ON COMMIT DROP staging table) so it also
+# works with transaction pooling.
+ENDPOINT = os.environ['db_endpoint']
+DBNAME = os.environ['db_name']
+DBUSER = os.environ['db_user']
+PORT = os.environ['db_port']
+DBPASS = os.environ['db_pass']
+CONNECT_TIMEOUT = int(os.environ.get('db_connect_timeout', '10'))
+
+connection = None
+
+
+def healthy(conn):
+    if conn.closed:
+        return False
+    try:
+        # A previous invocation killed by the timeout can leave a transaction open
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error as e:
+        logger.warning(f"Database connection is broken: {e}")
+        return False
+
+
+def close():
+    global connection
+    if connection is not None:
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        connection = None
+
+
+def connect():
+    global connection
+    if connection is not None and not healthy(connection):
+        close()
+    if connection is None:
+        # TCP keepalives so a connection dropped while the container was frozen is noticed instead of hanging
+        # https://www.postgresql.org/docs/current/libpq-connect.html#LIBPQ-KEEPALIVES
+        connection = psycopg2.connect(host=ENDPOINT, port=PORT, database=DBNAME, user=DBUSER,
+                                      password=secrets_cache.parameter(DBPASS), connect_timeout=CONNECT_TIMEOUT,
+                                      keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3,
+                                      application_name='container-image-pipeline-metrics')
+        logger.info(f"Connected to database {DBNAME} on {ENDPOINT}")
+    return connection
+
+
+@contextmanager
+def transaction():
+    # Commits when the block succeeds, rolls back when it raises. The connection is kept for the next invocation, unless
+    # it is broken
+    conn = connect()
+    cur = conn.cursor()
+    try:
+        yield cur
+        conn.commit()
+    except BaseException:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            close()
+        raise
+    finally:
+        if not cur.closed:
+            cur.close()
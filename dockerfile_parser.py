@@ -0,0 +1,99 @@
+from collections import namedtuple
+import re
+
+# Dockerfile reference: https://docs.docker.com/engine/reference/builder/
+# All the patterns are compiled once at import, a Dockerfile is scanned in a single pass over its FROM and ARG lines.
+
+# Line continuations are joined before scanning (the default escape character is a backslash)
+CONTINUATION = re.compile(r'\\[ \t]*\r?\n')
+# Instructions are case insensitive, only FROM and ARG matter to find the images
+INSTRUCTION = re.compile(r'^[ \t]*(FROM|ARG)[ \t]+([^\r\n#]*)', re.IGNORECASE | re.MULTILINE)
+# $VAR, ${VAR}, ${VAR:-default} and ${VAR:+alternative}
+VARIABLE = re.compile(r'\$(?:\{(\w+)(?::([-+])([^}]*))?\}|(\w+))')
+STAGE_ALIAS = re.compile(r'^as$', re.IGNORECASE)
+
+# registry: host (and port) of the registry, '' for Docker Hub images
+# repository: image path in the registry, tag/digest: '' when not given
+# stage: name given with AS, platform: value of --platform, '' when not given
+ImageRef = namedtuple('ImageRef', ['registry', 'repository', 'tag', 'digest', 'stage', 'platform'])
+
+
+def image_name(ref):
+    # Image without tag or digest, the way it is written in the FROM line
+    if ref.registry:
+        return f"{ref.registry}/{ref.repository}"
+    return ref.repository
+
+
+def substitute(value, args):
+    # Unknown variables are replaced by an empty string like docker build does
+    def replace(match):
+        name = match.group(1) or match.group(4)
+        current = args.get(name, '')
+        if match.group(2) == '-':
+            return current or match.group(3)
+        if match.group(2) == '+':
+            return match.group(3) if current else ''
+        return current
+    if '$' not in value:
+        return value
+    return VARIABLE.sub(replace, value)
+
+
+def parse_reference(reference):
+    # [registry[:port]/]repository[:tag][@digest]
+    digest = ''
+    if '@' in reference:
+        reference, digest = reference.split('@', 1)
+    tag = ''
+    colon = reference.rfind(':')
+    if colon > reference.rfind('/'):
+        reference, tag = reference[:colon], reference[colon + 1:]
+    registry = ''
+    if '/' in reference:
+        first, rest = reference.split('/', 1)
+        # Same rule as docker: the first component is a registry if it looks like a host
+        if '.' in first or ':' in first or first == 'localhost':
+            registry, reference = first, rest
+    return registry, reference, tag, digest
+
+
+def parse_images(content):
+    # Returns the images of the FROM lines in the order they appear. Global ARGs (declared before the first FROM) are
+    # substituted, FROM lines that point to an earlier build stage or to scratch are left out.
+    if '\\' in content:
+        content = CONTINUATION.sub(' ', content)
+    args = {}
+    stages = set()
+    images = []
+    seen_from = False
+    for match in INSTRUCTION.finditer(content):
+        instruction = match.group(1).upper()
+        words = match.group(2).split()
+        if instruction == 'ARG':
+            # Only ARGs before the first FROM can be used in FROM lines
+            if not seen_from:
+                for word in words:
+                    name, _, default = word.partition('=')
+                    args[name] = substitute(default.strip('"\''), args)
+            continue
+
+        seen_from = True
+        platform = ''
+        while words and words[0].startswith('--'):
+            flag = words.pop(0)
+            if flag.startswith('--platform='):
+                platform = substitute(flag[len('--platform='):], args)
+        if not words:
+            continue
+        reference = substitute(words[0], args)
+        stage = words[2] if len(words) > 2 and STAGE_ALIAS.match(words[1]) else ''
+        if reference.lower() in stages or reference == 'scratch' or not reference:
+            if stage:
+                stages.add(stage.lower())
+            continue
+        if stage:
+            stages.add(stage.lower())
+        registry, repository, tag, digest = parse_reference(reference)
+        images.append(ImageRef(registry, repository, tag, digest, stage, platform))
+    return images
@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor
+from github import Github  # Pygithub
+import threading
+import os
+
+# Number of files looked up at the same time. GitHub asks integrators to keep concurrency low to stay clear of the
+# secondary rate limits: https://docs.github.com/en/rest/guides/best-practices-for-integrators#dealing-with-secondary-rate-limits
+MAX_WORKERS = int(os.environ.get('github_concurrency', '5'))
+# Github API root, https://<host>/api/v3 for Github Enterprise Server or a local stand-in (see benchmarks/fake_github.py)
+BASE_URL = os.environ.get('github_base_url', 'https://api.github.com')
+
+thread_data = threading.local()
+
+
+def thread_github(token):
+    # PyGithub's Requester keeps a single persistent connection whose request()/getresponse() calls are not thread safe,
+    # so every worker thread logs in with its own client. A rotated token logs in again.
+    if getattr(thread_data, 'g', None) is None or thread_data.token != token:
+        thread_data.g = Github(token, base_url=BASE_URL)
+        thread_data.token = token
+    return thread_data.g
+
+
+def thread_repository(token, file):
+    # Re-bind the search result's repository to the client of the current thread. lazy=True doesn't make a request,
+    # the repository is fetched on first attribute access just like the partial object returned by the search
+    return thread_github(token).get_repo(file.repository.full_name, lazy=True)
+
+
+def executor(max_workers=MAX_WORKERS):
+    # Thread pool of a whole scan, None to look the files up sequentially. The worker threads and their Github clients
+    # (thread_github) are reused from one search page to the next instead of logging in again for every page.
+    return ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+
+
+def enrich_files(files, process_file, max_workers=MAX_WORKERS, executor=None):
+    # executor.map hands back the results in the order of the input files, so the rows end up in the same order as
+    # with the sequential loop no matter which request finishes first. Results are yielded as soon as they are ready so
+    # the rows can be streamed to the sink
+    if executor is not None:
+        yield from executor.map(process_file, files)
+        return
+    if max_workers <= 1:
+        for file in files:
+            yield process_file(file)
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from executor.map(process_file, files)
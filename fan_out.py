@@ -0,0 +1,228 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import instrumentation
+import secrets_cache
+import checkpoint
+import row_sink
+import loader
+import cache_db
+import hashlib
+import logging
+import shutil
+import json
+import time
+import csv
+import codecs
+import os
+
+logger = logging.getLogger()
+
+# Fan out (fan_out "org" or "partition"): instead of scanning every org one after the other in a single invocation, a
+# coordinator invokes one worker per org search (and per pipeline registry search), or per query partition, and loads
+# what they found in a single COPY. The wall time is the time of the slowest org instead of the sum of all of them, and
+# a slow org doesn't use up the timeout of the others.
+# On AWS the workers are synchronous invocations of the same function, outside of AWS they run in a local process
+# pool. Every worker writes its rows to a partial CSV (partial_bucket in S3, otherwise partial_dir) and its checkpoint
+# next to it. The worker checkpoints only move forward once the coordinator committed the rows, and a unit that ran out
+# of time is resumed by the next invocation like a single scan.
+# A file found by more than one worker (an org search and a registry search) produces the same rows twice, the merge
+# keeps a single row per key.
+FAN_OUT = os.environ.get('fan_out', '')
+CONCURRENCY = int(os.environ.get('fan_out_concurrency', '4'))
+PARTIAL_BUCKET = os.environ.get('partial_bucket', '')
+PARTIAL_PREFIX = 'partials/'
+PARTIAL_DIR = os.environ.get('partial_dir', '/tmp/partials')
+# Seconds the coordinator waits for a worker (the Lambda timeout)
+INVOKE_TIMEOUT = 900
+
+
+def unit_name(query):
+    return hashlib.sha1(query.encode()).hexdigest()[:8]
+
+
+def units(searches, mode):
+    # Units of work of the run: a search (and its pipeline images) per worker
+    import query_partitioner
+    import rate_limiter
+    import enrichment
+    import scan_engine
+    if mode == 'partition':
+        # Costs a few search requests in the coordinator, the workers then each get a search under the result limit.
+        # They are paced like the search requests of a scan, from the current rate limit.
+        rate_limiter.scheduler.refresh(enrichment.thread_github(scan_engine.github_token()))
+        partitions = []
+        for search in searches:
+            partitions += [[query, pipeline_images, search.query]
+                           for query, pipeline_images in scan_engine.partition_searches([search])]
+        # The workers search again on their side, the first pages of the probes mustn't stay in the warm container
+        query_partitioner.first_pages.clear()
+    elif mode == 'org':
+        partitions = [[search.query, sorted(search.pipeline_images), search.query] for search in searches]
+    else:
+        raise ValueError(f"Unknown fan out mode {mode}")
+    # cache: the SQLite cache of the worker, per org search so warm workers keep the repositories of their org
+    return [{'name': unit_name(query), 'query': query, 'pipeline_images': pipeline_images, 'cache': unit_name(search)}
+            for query, pipeline_images, search in partitions]
+
+
+def worker_checkpoint_name(event, created, unit):
+    # The unit checkpoints belong to the coordinator checkpoint created at created: a unit that completed late in a
+    # scan would otherwise still be complete in the scan of the next day and its org skipped
+    return f"{checkpoint.checkpoint_name(event)}-{int(created)}-{unit}"
+
+
+def local_path(run, unit, suffix):
+    return os.path.join(PARTIAL_DIR, run, f"{unit}.{suffix}")
+
+
+def put(run, unit, suffix):
+    if PARTIAL_BUCKET:
+        path = local_path(run, unit, suffix)
+        secrets_cache.client('s3').upload_file(path, PARTIAL_BUCKET, f"{PARTIAL_PREFIX}{run}/{unit}.{suffix}")
+        os.remove(path)
+
+
+def get(run, unit, suffix):
+    # Text stream of a partial
+    if PARTIAL_BUCKET:
+        body = secrets_cache.client('s3').get_object(Bucket=PARTIAL_BUCKET, Key=f"{PARTIAL_PREFIX}{run}/{unit}.{suffix}")['Body']
+        # StreamingBody only has read(), a codecs reader decodes it without loading the whole partial
+        return codecs.getreader('utf-8')(body)
+    return open(local_path(run, unit, suffix), newline='')
+
+
+def run_worker(event, context=None):
+    # Scans the unit of the event into a partial, returns the summary of the scan
+    import rate_limiter
+    import scan_engine
+    instrumentation.reset()
+    unit = event['fan_out_unit']
+    run = event['fan_out_run']
+    scan_checkpoint = checkpoint.load(worker_checkpoint_name(event, event['fan_out_created'], unit['name']))
+    if scan_checkpoint is not None and scan_checkpoint.get('complete'):
+        return {'unit': unit['name'], 'rows': 0, 'files_processed': 0, 'complete': True, 'partial': False}
+    # The deadline of the coordinator, it still has to load the partials after that
+    rate_limiter.scheduler.set_deadline(event.get('fan_out_deadline'))
+    rate_limiter.scheduler.set_workers(event.get('fan_out_workers', 1))
+    # Workers of different orgs don't overwrite each other's cache in S3. The key is restored afterwards, a warm
+    # container can run a single scan or a coordinator next.
+    cache_key = cache_db.CACHE_KEY
+    cache_db.CACHE_KEY = f"{unit['cache']}-{cache_key}"
+
+    os.makedirs(os.path.join(PARTIAL_DIR, run), exist_ok=True)
+    sink = row_sink.CsvSink(local_path(run, unit['name'], 'csv'))
+    try:
+        search = scan_engine.Search(unit['query'], frozenset(unit['pipeline_images']))
+        result = scan_engine.scan([search], sink, scan_checkpoint, event.get('fan_out_backend'))
+    finally:
+        sink.close()
+        cache_db.CACHE_KEY = cache_key
+    with open(local_path(run, unit['name'], 'checkpoint.json'), 'w') as f:
+        json.dump(dict(result.pop('checkpoint'), complete=result['complete']), f)
+    put(run, unit['name'], 'csv')
+    put(run, unit['name'], 'checkpoint.json')
+    return dict(result, unit=unit['name'], partial=True, metrics=instrumentation.summary(),
+                metric_units=instrumentation.metric_units())
+
+
+def init_process():
+    # The local workers are forked from the coordinator, they log in again instead of sharing the persistent connection
+    # of the Github client it left in its main thread
+    import enrichment
+    enrichment.thread_data.g = None
+
+
+def dispatch(event, context, units, created, deadline=None, backend=None):
+    # Runs the workers of the coordinator checkpoint created at created, CONCURRENCY at a time. A failed worker doesn't
+    # fail the others, its unit is tried again by the next invocation.
+    run = f"{checkpoint.checkpoint_name(event)}-{int(time.time())}"
+    workers = min(CONCURRENCY, len(units))
+    events = [dict(event, fan_out_unit=unit, fan_out_run=run, fan_out_created=created, fan_out_workers=workers,
+                   fan_out_deadline=deadline, fan_out_backend=backend) for unit in units]
+    print(f"Fanning out {len(units)} units to {workers} workers")
+    if not units:
+        return run, []
+
+    def failed(worker_event, error):
+        logger.error(f"Worker {worker_event['fan_out_unit']['name']} ({worker_event['fan_out_unit']['query']}) failed: {error}")
+        return {'unit': worker_event['fan_out_unit']['name'], 'complete': False, 'partial': False, 'error': str(error)}
+
+    if hasattr(context, 'function_name'):
+        def invoke(worker_event):
+            try:
+                response = secrets_cache.client('lambda', read_timeout=INVOKE_TIMEOUT).invoke(
+                    FunctionName=context.function_name, Payload=json.dumps(worker_event))
+                payload = json.load(response['Payload'])
+            except Exception as e:
+                return failed(worker_event, e)
+            if 'FunctionError' in response:
+                return failed(worker_event, payload.get('errorMessage'))
+            return payload
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return run, list(executor.map(invoke, events))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_process) as executor:
+        futures = [executor.submit(run_worker, worker_event) for worker_event in events]
+        results = []
+        for worker_event, future in zip(events, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(failed(worker_event, e))
+        return run, results
+
+
+def merge(run, results, sink):
+    # Streams the rows of every partial into the sink (a single COPY), returns the summary of the whole scan
+    rows = 0
+    key = [row_sink.FIELDS.index(column) for column in loader.PRIMARY_KEY]
+    seen = set()
+    for result in results:
+        if not result['partial']:
+            continue
+        with get(run, result['unit'], 'csv') as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in reader:
+                row_key = tuple(row[i] for i in key)
+                if row_key in seen:
+                    continue
+                seen.add(row_key)
+                sink.add_row(row)
+                rows += 1
+    instrumentation.count('rows_produced', rows)
+    # The Github requests, timings... of the workers in the metrics of the run. Their rows_produced count the rows
+    # found by more than one worker, the merge counted the unique ones.
+    for result in results:
+        if 'metrics' in result:
+            instrumentation.add({name: value for name, value in result['metrics'].items() if name != 'rows_produced'},
+                                result.get('metric_units', {}))
+    # A unit stopped by the rate limit stops the others too, they share the token
+    resets = [result['rate_limit_reset'] for result in results if result.get('stop_reason') == 'quota']
+    complete = all(result['complete'] for result in results)
+    return {'rows': rows, 'files_processed': sum(result.get('files_processed', 0) for result in results),
+            'complete': complete, 'stop_reason': 'quota' if resets else (None if complete else 'deadline'),
+            'rate_limit_reset': max(resets) if resets else None, 'workers': len(results),
+            'workers_failed': [result['unit'] for result in results if 'error' in result]}
+
+
+def commit(event, created, run, results):
+    # Once the rows are committed: moves the worker checkpoints forward, returns the units now complete
+    done = []
+    for result in results:
+        if result['partial']:
+            with get(run, result['unit'], 'checkpoint.json') as f:
+                checkpoint.save(worker_checkpoint_name(event, created, result['unit']), json.load(f))
+        if result['complete']:
+            done.append(result['unit'])
+    return done
+
+
+def cleanup(run, results):
+    # The partials of the run, loaded or not: a unit that wasn't committed is scanned again from its checkpoint
+    if PARTIAL_BUCKET:
+        keys = [f"{PARTIAL_PREFIX}{run}/{result['unit']}.{suffix}" for result in results if result['partial']
+                for suffix in ('csv', 'checkpoint.json')]
+        if keys:
+            secrets_cache.client('s3').delete_objects(Bucket=PARTIAL_BUCKET,
+                                                      Delete={'Objects': [{'Key': key} for key in keys]})
+    shutil.rmtree(os.path.join(PARTIAL_DIR, run), ignore_errors=True)
@@ -0,0 +1,63 @@
+import threading
+import logging
+import cache_db
+import json
+import time
+import os
+
+logger = logging.getLogger()
+
+# Index of (kind, repo, path) -> blob SHA and the images parsed from that blob. The code search results already carry
+# the blob SHA of every file, so an unchanged Dockerfile can reuse its parsed images without downloading the content
+# again. kind tells the parsers apart (pipeline keyword, non pipeline image lang list) since they extract different
+# images from the same file.
+# The index is uploaded to S3 with the cache after every run, so it is kept to the files the searches still find:
+# entries not found for file_index_ttl seconds (deleted or moved Dockerfiles) and the entries of other kinds (an earlier
+# image_lang_list or parser version) are evicted at the start of the run.
+CACHE_TTL = int(os.environ.get('file_index_ttl', str(7 * 86400)))
+
+stats = {'hits': 0, 'misses': 0}
+stats_lock = threading.Lock()
+# Entries reused during the run, their updated_at is moved forward at the end of it
+reused = []
+
+
+def init(kind):
+    cache_db.execute("CREATE TABLE IF NOT EXISTS file_index (kind TEXT, full_name TEXT, path TEXT, sha TEXT, "
+                     "images TEXT, updated_at REAL, PRIMARY KEY (kind, full_name, path))")
+    cache_db.execute("DELETE FROM file_index WHERE kind != ? OR updated_at < ?", (kind, time.time() - CACHE_TTL))
+    with stats_lock:
+        stats['hits'] = 0
+        stats['misses'] = 0
+        reused.clear()
+
+
+def get_images(kind, full_name, path, sha):
+    rows = cache_db.query("SELECT images FROM file_index WHERE kind = ? AND full_name = ? AND path = ? AND sha = ?",
+                          (kind, full_name, path, sha))
+    with stats_lock:
+        stats['hits' if rows else 'misses'] += 1
+        if rows:
+            reused.append((kind, full_name, path))
+    if rows:
+        return json.loads(rows[0][0])
+    return None
+
+
+def put_images(kind, full_name, path, sha, images):
+    cache_db.execute("INSERT OR REPLACE INTO file_index (kind, full_name, path, sha, images, updated_at) "
+                     "VALUES (?, ?, ?, ?, ?, ?)", (kind, full_name, path, sha, json.dumps(images), time.time()))
+
+
+def touch_reused():
+    # A single transaction for all the entries reused by the run, instead of a write for every hit
+    with stats_lock:
+        keys = list(reused)
+        reused.clear()
+    now = time.time()
+    cache_db.executemany("UPDATE file_index SET updated_at = ? WHERE kind = ? AND full_name = ? AND path = ?",
+                         [(now,) + key for key in keys])
+
+
+def log_stats():
+    logger.info(f"File index: {stats['hits']} unchanged Dockerfile(s) reused, {stats['misses']} downloaded")
@@ -0,0 +1,121 @@
+from github import GithubException, RateLimitExceededException
+from rate_limiter import scheduler
+import rate_limiter
+import enrichment
+import repo_cache
+import instrumentation
+import threading
+import requests
+import logging
+import json
+import os
+
+logger = logging.getLogger()
+
+# GraphQL fetch backend: the Dockerfile text and the repository metadata (archived flag, name, url, owner) of a whole
+# page of search results come back in a single aliased query instead of several REST requests per file.
+# https://docs.github.com/en/graphql/guides/forming-calls-with-graphql
+# A query costs 1 point no matter how many aliased repositories it asks for (well under the 500,000 node limit):
+# https://docs.github.com/en/graphql/overview/resource-limitations
+# Contributors aren't available in GraphQL, they are still fetched with REST (see repo_cache).
+# Github Enterprise Server serves GraphQL at /api/graphql next to the REST API at /api/v3
+if enrichment.BASE_URL.endswith('/api/v3'):
+    GRAPHQL_URL = enrichment.BASE_URL[:-len('/v3')] + '/graphql'
+else:
+    GRAPHQL_URL = enrichment.BASE_URL + '/graphql'
+# Files (and repositories) fetched in a single query
+BATCH_SIZE = int(os.environ.get('graphql_batch_size', '50'))
+TIMEOUT = 30
+
+REPOSITORY_FIELDS = 'isArchived name url owner { login ... on Organization { name } }'
+
+thread_data = threading.local()
+
+
+def session(token):
+    # requests sessions aren't thread safe either, one per thread like the PyGithub clients
+    if getattr(thread_data, 'session', None) is None:
+        thread_data.session = requests.Session()
+    thread_data.session.headers['Authorization'] = f"bearer {token}"
+    return thread_data.session
+
+
+def post(token, query):
+    response = session(token).post(GRAPHQL_URL, json={'query': query}, timeout=TIMEOUT)
+    headers = {key.lower(): value for key, value in response.headers.items()}
+    instrumentation.count('bytes_downloaded', len(response.content), 'Bytes')
+    try:
+        body = response.json()
+    except ValueError:
+        body = {'message': response.text}
+    if 'x-ratelimit-remaining' in headers:
+        scheduler.update('graphql', int(headers['x-ratelimit-remaining']), int(headers['x-ratelimit-limit']),
+                         int(headers['x-ratelimit-reset']))
+    # Same exceptions as PyGithub so the scheduler retries rate limited queries the same way
+    errors = body.get('errors') or []
+    if any(error.get('type') == 'RATE_LIMITED' for error in errors):
+        raise RateLimitExceededException(response.status_code, body, headers)
+    if response.status_code != 200 or body.get('data') is None:
+        raise GithubException(response.status_code, body, headers)
+    for error in errors:
+        # Repositories and files that don't exist come back as null with a NOT_FOUND error
+        if error.get('type') != 'NOT_FOUND':
+            logger.warning(f"GraphQL error: {error.get('message')}")
+    return body['data']
+
+
+def batch_query(repositories, blobs):
+    # repositories: full names whose metadata is needed, blobs: (full name, path) of the files whose text is needed.
+    # Returns the query and the aliases of every repository and file.
+    repository_aliases = {}
+    blob_aliases = {}
+    for full_name in repositories:
+        repository_aliases.setdefault(full_name, f"r{len(repository_aliases)}")
+    for full_name, path in blobs:
+        repository_aliases.setdefault(full_name, f"r{len(repository_aliases)}")
+        blob_aliases.setdefault((full_name, path), f"f{len(blob_aliases)}")
+
+    fields = {alias: [] for alias in repository_aliases.values()}
+    for full_name in repositories:
+        fields[repository_aliases[full_name]].append(REPOSITORY_FIELDS)
+    for (full_name, path), alias in blob_aliases.items():
+        # Same file the REST backend reads: the default branch, null when it was deleted since it was indexed
+        expression = json.dumps(f"HEAD:{path}")
+        fields[repository_aliases[full_name]].append(f"{alias}: object(expression: {expression}) "
+                                                     "{ ... on Blob { text isTruncated } }")
+    query = []
+    for full_name, alias in repository_aliases.items():
+        owner, name = full_name.split('/', 1)
+        query.append(f"{alias}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) "
+                     f"{{ {' '.join(fields[alias])} }}")
+    return "query { " + ' '.join(query) + " }", repository_aliases, blob_aliases
+
+
+def fetch(token, repositories, blobs):
+    # Returns {full name: metadata} for the repositories and {(full name, path): text} for the files. Metadata and text
+    # are None when the repository or file doesn't exist, the files GraphQL truncates are left out.
+    repositories = list(dict.fromkeys(repositories))
+    blobs = list(dict.fromkeys(blobs))
+    metadata = {}
+    texts = {}
+    for start in range(0, max(len(repositories), len(blobs)), BATCH_SIZE):
+        query, repository_aliases, blob_aliases = batch_query(repositories[start:start + BATCH_SIZE],
+                                                              blobs[start:start + BATCH_SIZE])
+        data = scheduler.call('graphql', rate_limiter.CONTENTS, post, token, query, endpoint='graphql')
+        for full_name in repositories[start:start + BATCH_SIZE]:
+            repository = data.get(repository_aliases[full_name])
+            if repository is None:
+                metadata[full_name] = None
+                continue
+            # Same values as the REST backend, organization is the display name of the org owning the repository. The
+            # owner of a user repository has no name (... on Organization doesn't match), neither has an unnamed org.
+            metadata[full_name] = {'archived': repository['isArchived'], 'name': repository['name'],
+                                   'url': repository['url'],
+                                   'organization': repository['owner'].get('name') or repo_cache.NO_ORGANIZATION}
+        for (full_name, path), alias in blob_aliases.items():
+            blob = (data.get(repository_aliases[full_name]) or {}).get(alias)
+            if blob is None:
+                texts[(full_name, path)] = None
+            elif not blob.get('isTruncated') and blob.get('text') is not None:
+                texts[(full_name, path)] = blob['text']
+    return metadata, texts
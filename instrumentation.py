@@ -0,0 +1,130 @@
+from contextlib import contextmanager
+import tracemalloc
+import threading
+import cProfile
+import logging
+import json
+import time
+import os
+
+logger = logging.getLogger()
+
+# Counters and timings of the current run: time per stage, Github requests per endpoint (count, time, rate limited
+# retries), rate limit sleep, bytes downloaded and rows. They are returned in the run result and emitted in CloudWatch
+# Embedded Metric Format, a JSON log line CloudWatch turns into metrics:
+# https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+NAMESPACE = os.environ.get('metrics_namespace', 'ContainerPipelineMetrics')
+# Set profile to "cpu", "memory" or "cpu,memory" to dump a cProfile and/or tracemalloc report to /tmp
+PROFILE = os.environ.get('profile', '')
+PROFILE_DIR = os.environ.get('profile_dir', '/tmp')
+
+lock = threading.Lock()
+values = {}
+units = {}
+
+
+def reset():
+    # Warm containers reuse the module, every run starts from zero
+    with lock:
+        values.clear()
+        units.clear()
+
+
+def count(name, value=1, unit='Count'):
+    with lock:
+        values[name] = values.get(name, 0) + value
+        units[name] = unit
+
+
+def add_time(name, seconds):
+    # Time of the worker threads adds up, a stage can take more seconds than the run
+    count(name, seconds, 'Seconds')
+
+
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+
+
+def stage(name):
+    return timer(f"stage.{name}.time")
+
+
+def request(endpoint, seconds, size=None):
+    count(f"http.{endpoint}.calls")
+    add_time(f"http.{endpoint}.time", seconds)
+    if size is not None:
+        count('bytes_downloaded', size, 'Bytes')
+
+
+def summary():
+    with lock:
+        return {name: round(value, 3) if isinstance(value, float) else value for name, value in sorted(values.items())}
+
+
+def metric_units():
+    with lock:
+        return dict(units)
+
+
+def add(metrics, metric_units):
+    # Counters of another invocation or process (a fan out worker, see fan_out) added to the ones of the run
+    for name, value in metrics.items():
+        count(name, value, metric_units.get(name, 'Count'))
+
+
+def emit(dimensions):
+    # One JSON line on stdout, the Lambda log agent sends it to CloudWatch Logs where it is extracted as metrics
+    metrics = summary()
+    document = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [list(dimensions)],
+                # At most 100 metrics per directive
+                'Metrics': [{'Name': name, 'Unit': units[name]} for name in list(metrics)[:100]],
+            }],
+        },
+    }
+    document.update(dimensions)
+    document.update(metrics)
+    print(json.dumps(document))
+
+
+@contextmanager
+def profiled(name):
+    # cProfile only sees the thread it runs in (the scan loop, the load), the time of the worker threads shows up in the
+    # http.* timings instead
+    cpu = 'cpu' in PROFILE
+    memory = 'memory' in PROFILE
+    profiler = cProfile.Profile() if cpu else None
+    if memory:
+        tracemalloc.start(25)
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        if profiler is not None:
+            profiler.disable()
+            path = os.path.join(PROFILE_DIR, f"{name}-{stamp}.prof")
+            profiler.dump_stats(path)
+            logger.info(f"cProfile stats written to {path} (python -m pstats {path})")
+        if memory:
+            # Without the allocations of the profilers themselves
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, cProfile.__file__),
+                                                                  tracemalloc.Filter(False, tracemalloc.__file__)])
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            path = os.path.join(PROFILE_DIR, f"{name}-{stamp}.tracemalloc.txt")
+            with open(path, 'w') as f:
+                f.write(f"current {current / 1024 / 1024:.1f} MB, peak {peak / 1024 / 1024:.1f} MB\n")
+                for statistic in snapshot.statistics('lineno')[:50]:
+                    f.write(f"{statistic}\n")
+            logger.info(f"tracemalloc report written to {path}")
@@ -1,31 +1,41 @@
-import psycopg2
 import logging
-import boto3
 import os
-import pipeline_metrics_all
-import non_pipeline_metrics
+import time
+import secrets_cache
+import db_connection
+import row_sink
+import loader
+import checkpoint
+import instrumentation
+import fan_out
+import snapshot
+import json
 
 # Logging https://dev.to/aws-builders/why-you-should-never-ever-print-in-a-lambda-function-3i37
 logger = logging.getLogger()
 logging.basicConfig(level=logging.INFO)  # To see output in local console
 logger.setLevel(logging.INFO)  # To see output in Lambda
 
-# Initialize boto3 client
-ssm = boto3.client('ssm')
-sns = boto3.client('sns')
+# The boto3 clients, the db password and the Github token are created/fetched on first use and reused by warm
+# containers (see secrets_cache). The scan modules (PyGithub...) are only imported by the runs that use them.
 
-# Variables
+# Variables (the db connection settings are in db_connection)
 DBTABLE = os.environ['db_table']
-ENDPOINT = os.environ['db_endpoint']
-DBNAME = os.environ['db_name']
-DBUSER = os.environ['db_user']
-PORT = os.environ['db_port']
-DBPASS = ssm.get_parameter(Name=os.environ['db_pass'], WithDecryption=True)
 SNS_TOPIC = os.environ['sns_topic']
+# Seconds kept at the end of the invocation for the db load, the scan stops early when it can't finish before that
+LOAD_RESERVE = int(os.environ.get('load_reserve_seconds', '60'))
+# When a scan stops early, invoke the function again to continue from the checkpoint (otherwise the next tick of the
+# schedule resumes it), at most max_continuations times in a row
+SELF_INVOKE = os.environ.get('self_invoke', 'false').lower() == 'true'
+MAX_CONTINUATIONS = int(os.environ.get('max_continuations', '10'))
+# Pipeline registries as Github code search keywords
+PIPELINE_KEYWORDS = "089022728777.dkr.ecr.us east 1.amazonaws.com, redventures container pipeline docker.jfrog.io"
+# Code search keywords of the non pipeline org searches
+ORG_KEYWORDS = "FROM "
 
 def notify(text):
     try:
-        sns.publish(TopicArn=SNS_TOPIC,
+        secrets_cache.client('sns').publish(TopicArn=SNS_TOPIC,
             Subject='Container pipeline metrics error',
             Message=text)
     except Exception as e:
@@ -34,87 +44,260 @@ def notify(text):
     logger.info(text)
 
 
+def continue_scan(event, context, scan_result):
+    continuation = event.get('continuation', 0) + 1
+    if scan_result.get('stop_reason') == 'quota':
+        # Invoking again before the reset would only stop again right away, until max_continuations is used up
+        logger.info(f"Scan not complete, the rate limit is used up until {time.ctime(scan_result['rate_limit_reset'])}, "
+                    f"the first scheduled run after that resumes it from the checkpoint")
+    elif not SELF_INVOKE or not hasattr(context, 'function_name'):
+        logger.info("Scan not complete, the next scheduled run resumes it from the checkpoint")
+    elif continuation > MAX_CONTINUATIONS:
+        notify(f"Scan {event['run_function']} still not complete after {MAX_CONTINUATIONS} continuations, the next scheduled run resumes it")
+    else:
+        # https://docs.aws.amazon.com/lambda/latest/dg/invocation-async.html
+        secrets_cache.client('lambda').invoke(FunctionName=context.function_name, InvocationType='Event',
+                             Payload=json.dumps(dict(event, continuation=continuation)))
+        logger.info(f"Scan not complete, invoked continuation {continuation}")
+
+
+def scan_deadline(context):
+    # Time after which the scan stops so the load can still finish
+    if hasattr(context, 'get_remaining_time_in_millis'):
+        return time.time() + context.get_remaining_time_in_millis() / 1000 - LOAD_RESERVE
+    return None
+
+
+def prepare_scheduler(context):
+    import rate_limiter
+    # A warm container can have run a fan out worker before
+    rate_limiter.scheduler.set_workers(1)
+    if hasattr(context, 'get_remaining_time_in_millis'):
+        rate_limiter.scheduler.set_deadline(scan_deadline(context))
+
+
+def run_scan(event, context, sink, scan_checkpoint):
+    prepare_scheduler(context)
+    run_function = event['run_function']
+    # "rest" or "graphql", defaults to the fetch_backend environment variable
+    backend = event.get('fetch_backend')
+    # Only the module of the run is imported
+    if run_function == "metrics_all":
+        # Pipeline and non pipeline metrics in a single pass
+        import scan_engine
+        org_list = event['org_list']
+        return scan_engine.search_github(PIPELINE_KEYWORDS, org_list, sink=sink, checkpoint=scan_checkpoint, backend=backend)
+    elif run_function == "pipeline_metrics_all":
+        import pipeline_metrics_all
+        return pipeline_metrics_all.search_github(PIPELINE_KEYWORDS, sink=sink, checkpoint=scan_checkpoint, backend=backend)
+    else:
+        import non_pipeline_metrics
+        org_list = event['org_list']
+        return non_pipeline_metrics.search_github(ORG_KEYWORDS, org_list, sink=sink, checkpoint=scan_checkpoint, backend=backend)
+
+
+def scan_searches(event):
+    # Searches of the run for the fan out, same as the search_github of the run_function
+    import scan_engine
+    run_function = event['run_function']
+    if run_function == "metrics_all":
+        return scan_engine.org_searches(event['org_list']) + scan_engine.registry_searches(PIPELINE_KEYWORDS)
+    elif run_function == "pipeline_metrics_all":
+        return scan_engine.registry_searches(PIPELINE_KEYWORDS, scan_engine.PIPELINE)
+    return scan_engine.org_searches(event['org_list'], scan_engine.NON_PIPELINE, ORG_KEYWORDS)
+
+
+def coordinate(event, context, mode, coordinator_checkpoint):
+    # Runs the units of the fan out not loaded yet, returns the worker results. The units are computed once per
+    # coordinator checkpoint so continuations resume the same units.
+    if coordinator_checkpoint is None or coordinator_checkpoint['units'] is None:
+        prepare_scheduler(context)
+        created = coordinator_checkpoint['created'] if coordinator_checkpoint is not None else time.time()
+        coordinator_checkpoint = {'units': fan_out.units(scan_searches(event), mode), 'done': [], 'created': created}
+    pending = [unit for unit in coordinator_checkpoint['units'] if unit['name'] not in coordinator_checkpoint['done']]
+    run, results = fan_out.dispatch(event, context, pending, coordinator_checkpoint['created'], scan_deadline(context),
+                                    event.get('fetch_backend'))
+    return coordinator_checkpoint, run, results
+
+
+def migrate_tables():
+    # One off run (run_function "migrate_tables"): partitions a db table created before the partitioning and rebuilds
+    # the rollups from the whole history
+    try:
+        with db_connection.transaction() as cur:
+            cur.execute("SET LOCAL datestyle TO ISO, MDY")
+            return loader.migrate_tables(cur, DBTABLE)
+    except Exception as e:
+        notify(f"Migration of db table {DBTABLE} failed due to {e}")
+        raise
+
+
+def export_snapshots(event):
+    # One off run (run_function "export_snapshots"): writes the history of the db table to Parquet snapshots, one file
+    # per date (before: only the days before that date, YYYY-MM-DD, e.g. the day the snapshots were turned on)
+    parquet_sink = snapshot.sink(DBTABLE, 'export', ordered=True, required=True)
+    try:
+        with db_connection.transaction() as cur:
+            rows = loader.export_rows(cur, DBTABLE, parquet_sink, event.get('before'))
+        parquet_sink.close()
+    except Exception as e:
+        snapshot.discard(parquet_sink)
+        notify(f"Export of db table {DBTABLE} to Parquet snapshots failed due to {e}")
+        raise
+    return dict(snapshot.publish(parquet_sink), rows_exported=rows)
+
+
 def main(event, context):
+    # Stage timings, Github requests, rate limit sleep, bytes and rows of the run, in the result and as CloudWatch metrics
+    # (Embedded Metric Format). profile=cpu,memory dumps a cProfile/tracemalloc report of the run to /tmp.
+    instrumentation.reset()
+    run_function = event['run_function']
+    try:
+        with instrumentation.profiled(run_function):
+            result = run(event, context)
+    finally:
+        instrumentation.emit({'RunFunction': run_function})
+    if isinstance(result, dict):
+        result['metrics'] = instrumentation.summary()
+    return result
+
+
+def run(event, context):
+    run_function = event['run_function']
+    if 'fan_out_unit' in event:
+        # Worker of a fan out, the coordinator loads its rows
+        return fan_out.run_worker(event, context)
+    if run_function == "migrate_tables":
+        return migrate_tables()
+    if run_function == "export_snapshots":
+        return export_snapshots(event)
+    if run_function not in ("metrics_all", "pipeline_metrics_all") and "non_pipeline_metrics" not in run_function:
+        notify("Invalid function provided..exiting")
+        raise ValueError(f"Invalid run_function {run_function}")
+
+    # "org" or "partition" fans the scan out to one worker per org search or per query partition (see fan_out)
+    fan_out_mode = event.get('fan_out', fan_out.FAN_OUT)
+    checkpoint_name = checkpoint.checkpoint_name(event)
+    if fan_out_mode:
+        checkpoint_name = f"{checkpoint_name}-fan-out"
+    scan_checkpoint = checkpoint.load(checkpoint_name)
+    if scan_checkpoint is not None and scan_checkpoint.get('complete'):
+        logger.info(f"Scan {checkpoint_name} already complete, nothing to do until the checkpoint expires")
+        return {'complete': True}
+    if scan_checkpoint is not None and (scan_checkpoint.get('rate_limit_reset') or 0) > time.time():
+        logger.info(f"Scan {checkpoint_name} waits for the rate limit reset at {time.ctime(scan_checkpoint['rate_limit_reset'])}")
+        return {'complete': False, 'stop_reason': 'quota', 'rate_limit_reset': scan_checkpoint['rate_limit_reset']}
+
+    # Errors are raised after the notification (instead of exit(1)) so the transaction is rolled back and the warm
+    # container keeps its connection
     try:
-        conn = psycopg2.connect(host=ENDPOINT, port=PORT, database=DBNAME, user=DBUSER, password=DBPASS['Parameter']['Value'])
-        cur = conn.cursor()
+        db_connection.connect()
     except Exception as e:
         notify("Database connection failed due to {}".format(e))
-        exit(1)
+        raise
 
     try:
-        run_function = event['run_function']
-        if run_function == "pipeline_metrics_all":
-            function = pipeline_metrics_all.search_github("089022728777.dkr.ecr.us east 1.amazonaws.com, redventures container pipeline docker.jfrog.io")
-        elif "non_pipeline_metrics" in run_function:
-            org_list = event['org_list']
-            function = non_pipeline_metrics.search_github("FROM ", run_function, org_list)
-        else:
-            notify("Invalid function provided..exiting")
-            exit(1)
-        function
+        # In a transaction of its own: CREATE INDEX IF NOT EXISTS locks the table, it mustn't stay locked during the scan
+        with instrumentation.stage('setup'), db_connection.transaction() as cur:
+            loader.create_table(cur, DBTABLE)
     except Exception as e:
-        notify("Creation of search metrics CSV failed due to {}".format(e))
-        exit(1)
+        notify(f"Unable to find info about db table: {e}")
+        raise
+
+    if fan_out_mode:
+        import rate_limiter
+        # The workers scan before the load transaction is opened (after the db checks, a run that can't load doesn't
+        # start them), this invocation only loads their partials
+        try:
+            with instrumentation.stage('fan_out'):
+                scan_checkpoint, fan_out_run, workers = coordinate(event, context, fan_out_mode, scan_checkpoint)
+        except rate_limiter.BudgetExhausted as e:
+            # Stopped while partitioning the searches, before any worker ran: nothing to load. The next invocation
+            # builds the units again, not before the reset when the rate limit is used up.
+            logger.warning(f"Fan out of {run_function} stopped before the workers: {e}")
+            scan_result = {'rows': 0, 'files_processed': 0, 'complete': False, 'stop_reason': e.reason,
+                           'rate_limit_reset': e.reset, 'workers': 0, 'workers_failed': []}
+            created = scan_checkpoint['created'] if scan_checkpoint is not None else time.time()
+            checkpoint.save(checkpoint_name, {'units': None, 'done': [], 'created': created, 'complete': False,
+                                              'rate_limit_reset': e.reset if e.reason == 'quota' else None})
+            continue_scan(event, context, scan_result)
+            return scan_result
+        except Exception as e:
+            notify(f"Fan out of {run_function} failed due to {e}")
+            raise
 
+    # The staging table, the COPY and the upsert are a single transaction: committed when the load went through, rolled
+    # back when anything failed so a failed run leaves nothing behind
+    stage = "Creation of search metrics"
+    parquet_sink = None
     try:
-        # Create table if table doesn't exist
-        cur.execute(f"CREATE TABLE IF NOT EXISTS {DBTABLE} (Date TIMESTAMP, Organization VARCHAR, Repository VARCHAR, Filename VARCHAR, Registry VARCHAR, Image VARCHAR, ImageLang VARCHAR, Version VARCHAR, RepoURL VARCHAR, PipelineImage VARCHAR, TopContributors VARCHAR, PRIMARY KEY (Date, Organization, Repository, Filename, Registry, Image, Version))")
-        cur.execute(f"SELECT COUNT(*) AS num_rows FROM {DBTABLE}")
-        query_results = cur.fetchone()
-        logger.info(f"Num of rows in db table {DBTABLE}: {query_results[0]}")
-        cur.execute(f"SET datestyle TO ISO, MDY")
-    except (Exception, psycopg2.DatabaseError) as e:
-        notify(f"Unable to find info about db table: {e}")
-        exit(1)
-    if query_results[0] == 0:
-        # If db table is empty, insert data for the first time
+        with db_connection.transaction() as cur:
+            cur.execute("SET LOCAL datestyle TO ISO, MDY")
+            # The search results are streamed into a staging table and upserted from there
+            staging_table = loader.create_staging_table(cur, DBTABLE)
+            # Rows go straight from the Github search into the staging table with COPY, no intermediate CSV file
+            copy_sink = row_sink.CopySink(cur, staging_table)
+            # And to a Parquet snapshot when snapshot is turned on
+            parquet_sink = snapshot.sink(DBTABLE, f"{checkpoint_name}-{int(time.time())}")
+            sink = copy_sink if parquet_sink is None else row_sink.TeeSink(copy_sink, parquet_sink)
+            sink = row_sink.with_debug_table(sink)
+            try:
+                with instrumentation.stage('scan'):
+                    if fan_out_mode:
+                        # All the partials in one COPY
+                        scan_result = fan_out.merge(fan_out_run, workers, sink)
+                    else:
+                        scan_result = run_scan(event, context, sink, scan_checkpoint)
+            finally:
+                # Ends the COPY, also when the scan failed so the transaction can be rolled back
+                sink.close()
+
+            stage = f"Insertion of data into db table {DBTABLE}"
+            # Same path for the first load and the daily loads: new rows are inserted, rows already loaded are skipped
+            with instrumentation.stage('load'):
+                result = loader.upsert(cur, DBTABLE, staging_table, copy_sink.copied)
+            for name in ('rows_inserted', 'rows_updated', 'rows_skipped'):
+                instrumentation.count(name, result[name])
+            stage = f"Refresh of the rollups of db table {DBTABLE}"
+            # Only the days of this load are recomputed, in the same transaction as the rows
+            with instrumentation.stage('rollups'):
+                result['rollup_dates'] = loader.refresh_rollups(cur, DBTABLE, staging_table)
+    except Exception as e:
+        notify(f"{stage} failed due to {e}")
+        if parquet_sink is not None:
+            snapshot.discard(parquet_sink)
+        if fan_out_mode:
+            # Nothing was loaded, the units are scanned again from their checkpoints
+            fan_out.cleanup(fan_out_run, workers)
+        raise
+
+    # The checkpoint only moves forward once the rows are committed
+    if fan_out_mode:
         try:
-            logger.info("Trying to insert data for the first time...")
-            # Here we are going load the csv file and use copy_from() to copy it to db table
-            tmp_csv = "/tmp/output.csv"
-            with open(tmp_csv, 'r') as f:
-                next(f)  # skip the first line
-                cur.copy_from(f, DBTABLE, sep=",")
-            os.remove(tmp_csv)
-        except (Exception, psycopg2.DatabaseError) as e:
-            notify(f"First data insertion into db table failed: {e}")
-            exit(1)
-        cur.execute(f"SELECT COUNT(*) AS num_rows FROM {DBTABLE}")
-        query_results = cur.fetchone()
-        text = f"First data insertion successfully completed!\n"
-        text += f"\nNum of rows inserted into db table {DBTABLE}: {query_results[0]}"
-        print(text)
+            scan_checkpoint['done'] += fan_out.commit(event, scan_checkpoint['created'], fan_out_run, workers)
+        finally:
+            fan_out.cleanup(fan_out_run, workers)
+        scan_result['complete'] = len(scan_checkpoint['done']) == len(scan_checkpoint['units'])
+        if scan_result['workers_failed']:
+            notify(f"Fan out workers {', '.join(scan_result['workers_failed'])} of {run_function} failed, the next invocation retries them")
     else:
-        # If db table is not empty, load new data records into db table
+        scan_checkpoint = scan_result.pop('checkpoint')
+    scan_checkpoint['complete'] = scan_result['complete']
+    # The next runs don't start before the reset
+    scan_checkpoint['rate_limit_reset'] = scan_result['rate_limit_reset'] if scan_result['stop_reason'] == 'quota' else None
+    checkpoint.save(checkpoint_name, scan_checkpoint)
+    if not scan_result['complete']:
+        continue_scan(event, context, scan_result)
+
+    if parquet_sink is not None:
+        # The rows are already loaded, a failed upload only loses the snapshot of this run
         try:
-            # Clone table structure of destination table to a temp table
-            tmp_table = "tmp"
-            # cur.execute(f"CREATE TEMPORARY TABLE {tmp_table} (Date TIMESTAMP, Organization VARCHAR, Repository VARCHAR, Filename VARCHAR, Registry VARCHAR, Image VARCHAR, ImageLang VARCHAR, Version VARCHAR, RepoURL VARCHAR, PipelineImage VARCHAR, PRIMARY KEY (Organization, Repository, Filename, Registry, Image, Version))")
-            cur.execute(f"CREATE TEMPORARY TABLE {tmp_table} AS (SELECT * FROM {DBTABLE} LIMIT 0)")
-
-            # Copy data into the temp table
-            tmp_csv = "/tmp/output.csv"
-            with open(tmp_csv, 'r') as f:
-                next(f)  # skip the first line
-                cur.copy_from(f, tmp_table, sep=",")
-            os.remove(tmp_csv)
-
-            # Copy all records found today present in temp table to db table
-            cur.execute(f"INSERT INTO {DBTABLE} SELECT tmp.* FROM {tmp_table} EXCEPT SELECT * FROM {DBTABLE} ON CONFLICT DO NOTHING")
-            # Drop the temporary table
-            cur.execute(f"DROP TABLE {tmp_table}")
-
-            cur.execute(f"SELECT COUNT(*) AS num_rows FROM {DBTABLE}")
-            query_results = cur.fetchone()
-            print(f"Num of rows in db table {DBTABLE}: {query_results[0]}")
-        except (Exception, psycopg2.DatabaseError) as e:
-            notify(f"Daily insertion of data failed: {e}")
-            exit(1)
-
-
-    cur.close()
-    conn.commit()
+            result.update(snapshot.publish(parquet_sink))
+            instrumentation.count('snapshot_bytes', result['snapshot_bytes'], 'Bytes')
+        except Exception as e:
+            logger.error(f"Unable to publish the Parquet snapshot: {e}")
+    result.update(scan_result)
+    return result
 
 
 if __name__ == '__main__':
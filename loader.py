@@ -0,0 +1,172 @@
+import row_sink
+import datetime
+import logging
+
+logger = logging.getLogger()
+
+PRIMARY_KEY = ["Date", "Organization", "Repository", "Filename", "Registry", "Image", "Version"]
+
+
+# Columns the daily rollup is grouped by
+ROLLUP_KEY = ["Date", "Organization", "ImageLang", "Registry", "PipelineImage"]
+
+
+def create_table(cur, table):
+    # Create table if table doesn't exist. The table is range partitioned by month on Date so the dashboard queries over
+    # a date range only read the partitions of that range: https://www.postgresql.org/docs/current/ddl-partitioning.html
+    # Tables created before the partitioning keep working unpartitioned until the migrate_tables run converts them.
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {table} (Date TIMESTAMP, Organization VARCHAR, Repository VARCHAR, Filename VARCHAR, Registry VARCHAR, Image VARCHAR, ImageLang VARCHAR, Version VARCHAR, RepoURL VARCHAR, PipelineImage VARCHAR, TopContributors VARCHAR, PRIMARY KEY ({', '.join(PRIMARY_KEY)})) PARTITION BY RANGE (Date)")
+    # The dashboards filter by organization over a date range, the primary key only helps queries by date
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_organization_date_idx ON {table} (Organization, Date)")
+    # This month and the next one, a scan running past midnight at the end of the month produces rows of the next month
+    today = datetime.date.today()
+    create_partition(cur, table, today)
+    create_partition(cur, table, (today.replace(day=1) + datetime.timedelta(days=32)))
+    create_rollup_tables(cur, table)
+
+
+def exists(cur, relation):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (relation,))
+    return cur.fetchone()[0]
+
+
+def partitioned(cur, table):
+    cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def create_partition(cur, table, day):
+    # Partition of the month of day, named {table}_yYYYYmMM
+    if not partitioned(cur, table):
+        return
+    start = day.replace(day=1)
+    end = (start + datetime.timedelta(days=32)).replace(day=1)
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {table}_y{start:%Y}m{start:%m} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{start}') TO ('{end}')")
+
+
+def create_rollup_tables(cur, table):
+    # {table}_daily: images, repositories and Dockerfiles per day, organization, image lang, registry and pipeline image.
+    # A few hundred rows a day instead of one row per image, the dashboards over time read it instead of the history.
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {table}_daily (Date TIMESTAMP, Organization VARCHAR, ImageLang VARCHAR, Registry VARCHAR, PipelineImage VARCHAR, Images INTEGER, Repositories INTEGER, Dockerfiles INTEGER)")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_daily_date_idx ON {table}_daily (Date)")
+    # {table}_latest: the rows of the last snapshot of each organization. The last date of every organization comes from
+    # the rollup so the view only reads the partition (and index entries) of that date
+    if exists(cur, f"{table}_latest"):
+        return
+    cur.execute(f"""
+        CREATE VIEW {table}_latest AS
+        SELECT {table}.* FROM {table}
+        JOIN (SELECT Organization, MAX(Date) AS Date FROM {table}_daily GROUP BY Organization) latest
+        USING (Organization, Date)
+    """)
+
+
+def refresh_rollups(cur, table, staging_table=None):
+    # Recomputes the rollup of the days loaded from the staging table (all the days without a staging table). Only those
+    # days are read from the db table, the rest of the rollup is left as is.
+    # Runs of other schedules can load the same day at the same time, the lock makes them recompute it one after the
+    # other so the last one sees the rows of both.
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"{table}_daily",))
+    if staging_table is None:
+        cur.execute(f"SELECT DISTINCT Date FROM {table}")
+    else:
+        cur.execute(f"SELECT DISTINCT Date FROM {staging_table}")
+    dates = [row[0] for row in cur.fetchall()]
+    if not dates:
+        return []
+    key = ', '.join(ROLLUP_KEY)
+    cur.execute(f"DELETE FROM {table}_daily WHERE Date = ANY(%s)", (dates,))
+    cur.execute(f"""
+        INSERT INTO {table}_daily ({key}, Images, Repositories, Dockerfiles)
+        SELECT {key}, COUNT(*), COUNT(DISTINCT Repository), COUNT(DISTINCT (Repository, Filename))
+        FROM {table} WHERE Date = ANY(%s)
+        GROUP BY {key}
+    """, (dates,))
+    logger.info(f"Refreshed the {table}_daily rollup of {len(dates)} day(s): {cur.rowcount} row(s)")
+    return [date.strftime('%Y-%m-%d') for date in sorted(dates)]
+
+
+def migrate_tables(cur, table):
+    # Converts a db table created before the partitioning: the rows are copied into a new partitioned table and the old
+    # table is kept as {table}_unpartitioned (drop it once the dashboards are checked). Then rebuilds the whole rollup.
+    result = {'migrated': False}
+    if exists(cur, table) and not partitioned(cur, table):
+        old_table = f"{table}_unpartitioned"
+        cur.execute(f"DROP VIEW IF EXISTS {table}_latest")
+        cur.execute(f"ALTER TABLE {table} RENAME TO {old_table}")
+        # The constraint and index names would clash with the ones of the new table
+        cur.execute(f"ALTER TABLE {old_table} RENAME CONSTRAINT {table}_pkey TO {old_table}_pkey")
+        cur.execute(f"ALTER INDEX IF EXISTS {table}_organization_date_idx RENAME TO {old_table}_organization_date_idx")
+        create_table(cur, table)
+        cur.execute(f"SELECT DISTINCT date_trunc('month', Date) FROM {old_table}")
+        for (month,) in cur.fetchall():
+            create_partition(cur, table, month.date())
+        columns = ', '.join(row_sink.FIELDS)
+        cur.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {old_table}")
+        logger.info(f"Moved {cur.rowcount} row(s) from {old_table} into the partitioned table {table}")
+        result = {'migrated': True, 'rows_migrated': cur.rowcount}
+    else:
+        create_table(cur, table)
+    result['rollup_dates'] = len(refresh_rollups(cur, table))
+    return result
+
+
+def create_staging_table(cur, table):
+    # Temporary tables are never WAL-logged (same as an UNLOGGED table) and are private to the session, so runs of
+    # different schedules can't step on each other's staging rows. The table only lives as long as the load transaction,
+    # so a pooled server connection isn't left with it.
+    staging_table = f"{table}_staging"
+    cur.execute(f"CREATE TEMPORARY TABLE IF NOT EXISTS {staging_table} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+    cur.execute(f"TRUNCATE {staging_table}")
+    return staging_table
+
+
+def upsert(cur, table, staging_table, staged):
+    # staged: rows copied into the staging table (the COPY row count, no need to count the staging table again)
+    # Only the rows of the staging table are looked up through the primary key index, so the load time stays flat as
+    # the history in the db table grows (unlike INSERT ... EXCEPT SELECT * FROM table).
+    # A file can be found by more than one search, DISTINCT ON keeps a single row per key.
+    # Rows already loaded today are skipped, unless their contributors changed. The update and the insert are two
+    # statements (instead of ON CONFLICT DO UPDATE ... RETURNING xmax, which partitioned tables don't support) and their
+    # row counts tell the updated rows from the inserted ones.
+    columns = ', '.join(row_sink.FIELDS)
+    key = ', '.join(PRIMARY_KEY)
+    match = ' AND '.join(f"{table}.{column} = staged.{column}" for column in PRIMARY_KEY)
+    cur.execute(f"""
+        UPDATE {table} SET TopContributors = staged.TopContributors
+        FROM (SELECT DISTINCT ON ({key}) {columns} FROM {staging_table} ORDER BY {key}) staged
+        WHERE {match} AND {table}.TopContributors IS DISTINCT FROM staged.TopContributors
+    """)
+    updated = cur.rowcount
+    cur.execute(f"""
+        INSERT INTO {table} ({columns})
+        SELECT DISTINCT ON ({key}) {columns} FROM {staging_table} ORDER BY {key}
+        ON CONFLICT ({key}) DO NOTHING
+    """)
+    inserted = cur.rowcount
+    skipped = staged - inserted - updated
+    logger.info(f"Loaded {staged} row(s) into db table {table}: {inserted} inserted, {updated} updated, {skipped} skipped")
+    return {'rows_staged': staged, 'rows_inserted': inserted, 'rows_updated': updated, 'rows_skipped': skipped}
+
+
+def export_rows(cur, table, sink, before=None):
+    # Streams the rows of the db table into the sink, sorted by date, FETCH by FETCH so only a batch is in memory.
+    # Returns the number of rows.
+    columns = ', '.join(row_sink.FIELDS)
+    where = "WHERE Date < %s" if before else ""
+    cur.execute(f"DECLARE export_rows NO SCROLL CURSOR FOR SELECT {columns} FROM {table} {where} ORDER BY Date",
+                (before,) if before else None)
+    rows = 0
+    while True:
+        cur.execute("FETCH 10000 FROM export_rows")
+        batch = cur.fetchall()
+        if not batch:
+            break
+        for row in batch:
+            sink.add_row(row)
+        rows += len(batch)
+    cur.execute("CLOSE export_rows")
+    logger.info(f"Exported {rows} row(s) of db table {table}")
+    return rows
@@ -0,0 +1,121 @@
+from concurrent.futures import ThreadPoolExecutor
+from rate_limiter import scheduler
+import rate_limiter
+import enrichment
+import logging
+import math
+import os
+import re
+
+logger = logging.getLogger()
+
+# Github search API returns at most 1000 results per query: https://docs.github.com/en/rest/reference/search#about-the-search-api
+# A query over the limit is split in narrower queries until every partition is under it:
+#   1. size: ranges (bytes), enough ranges for the results to fit, spaced geometrically since most Dockerfiles are a
+#      few KB (a third of the search requests of a bisection on a big org)
+#   2. repo: when a single size still has too many results, one query per repository of the org
+#   3. path: when a repository still has too many results, one query for the root directory and one per top directory
+# https://docs.github.com/en/search-github/searching-on-github/searching-code
+SEARCH_RESULT_LIMIT = 1000
+# Code search only indexes files smaller than 384 KB
+MAX_FILE_SIZE = 384 * 1024
+# Most ranges a query is split into at once
+MAX_SPLIT = 16
+# Queries probed in parallel, the search requests are still paced by the scheduler
+PARTITION_CONCURRENCY = int(os.environ.get('partition_concurrency', '3'))
+
+SIZE_RANGE = re.compile(r'\s*\bsize:(\d+)\.\.(\d+)')
+ORG = re.compile(r'\borg:(\S+)')
+REPO = re.compile(r'\brepo:(\S+)')
+
+# query: (total count, first page) of the partitions, the scan reuses them instead of searching again
+first_pages = {}
+
+
+def probe(token, query):
+    client = enrichment.thread_github(token)
+    result = client.search_code(query, order='desc')
+    page = scheduler.call('search', rate_limiter.SEARCH, result.get_page, 0, endpoint='search', client=client)
+    # totalCount of an empty result would send another (unscheduled) request
+    return (result.totalCount if page else 0), page
+
+
+def list_pages(paginated_list, client, priority, endpoint):
+    items = []
+    page_number = 0
+    while True:
+        page = scheduler.call('core', priority, paginated_list.get_page, page_number, endpoint=endpoint, client=client)
+        if not page:
+            return items
+        items.extend(page)
+        page_number += 1
+
+
+def size_ranges(low, high, total):
+    # Splits low..high in consecutive ranges, evenly spaced on a log scale
+    count = min(max(2, math.ceil(total / SEARCH_RESULT_LIMIT)), MAX_SPLIT, high - low + 1)
+    starts = [low]
+    for i in range(1, count):
+        start = int(round(math.exp(math.log(low + 1) + (math.log(high + 1) - math.log(low + 1)) * i / count))) - 1
+        starts.append(max(start, starts[-1] + 1))
+    ends = [start - 1 for start in starts[1:]] + [high]
+    return [(start, end) for start, end in zip(starts, ends) if start <= end]
+
+
+def split(token, query, total):
+    # Returns narrower queries covering the results of the query, None when it can't be split any further
+    client = enrichment.thread_github(token)
+    size = SIZE_RANGE.search(query)
+    low, high = (int(size.group(1)), int(size.group(2))) if size else (0, MAX_FILE_SIZE)
+    if low < high:
+        base = SIZE_RANGE.sub('', query)
+        return [f"{base} size:{start}..{end}" for start, end in size_ranges(low, high, total)]
+
+    org = ORG.search(query)
+    if org is not None:
+        # get_organization isn't lazy, it sends the request
+        organization = scheduler.call('core', rate_limiter.REPOSITORY, client.get_organization, org.group(1),
+                                      endpoint='organization', client=client)
+        repositories = list_pages(organization.get_repos(), client, rate_limiter.REPOSITORY, 'org_repositories')
+        return [ORG.sub(f"repo:{repository.full_name}", query) for repository in repositories
+                if not repository.archived]
+
+    repo = REPO.search(query)
+    if repo is not None and 'path:' not in query:
+        repository = client.get_repo(repo.group(1), lazy=True)
+        contents = scheduler.call('core', rate_limiter.CONTENTS, repository.get_contents, '', endpoint='directory',
+                                  client=client)
+        directories = [content.path for content in contents if content.type == 'dir']
+        return [f"{query} path:/"] + [f"{query} path:{directory}" for directory in directories]
+    return None
+
+
+def partition(token, query):
+    # Returns the queries to run instead of query, each one under SEARCH_RESULT_LIMIT results (unless it can't be split
+    # any further). A query under the limit is returned as is, the partitions without results are left out. The
+    # queries of each level of the split are probed in parallel.
+    partitions = []
+    level = [query]
+    probes = 0
+    with ThreadPoolExecutor(max_workers=PARTITION_CONCURRENCY) as executor:
+        while level:
+            next_level = []
+            for part, (total, page) in zip(level, executor.map(lambda part: probe(token, part), level)):
+                probes += 1
+                if total <= SEARCH_RESULT_LIMIT:
+                    if total:
+                        partitions.append(part)
+                        first_pages[part] = (total, page)
+                    continue
+                parts = split(token, part, total)
+                if parts is None:
+                    logger.warning(f"{part} has {total} results and can't be split any further, "
+                                   f"only the first {SEARCH_RESULT_LIMIT} are scanned")
+                    partitions.append(part)
+                    first_pages[part] = (total, page)
+                else:
+                    next_level.extend(parts)
+            level = next_level
+    if partitions != [query]:
+        logger.info(f"Split {query} in {len(partitions)} partitions ({probes} search requests)")
+    return partitions
@@ -0,0 +1,196 @@
+from github import GithubException, RateLimitExceededException
+import instrumentation
+import threading
+import calendar
+import logging
+import heapq
+import time
+import os
+
+logger = logging.getLogger()
+
+# Github has separate quotas for the core API (5000 requests/hour), the search API (30 requests/minute) and the GraphQL
+# API (5000 points/hour): https://docs.github.com/en/rest/overview/resources-in-the-rest-api#rate-limiting
+# Every request goes through the scheduler, it keeps track of both buckets from the response headers, spreads the
+# search requests over the search window and waits for the reset when a bucket runs dry. When the wait would go past
+# the deadline (Lambda timeout) it raises BudgetExhausted so the run can stop cleanly instead of being killed.
+
+# Priorities, lower goes first: search pages, then repository metadata, then file contents and contributors
+SEARCH = 0
+REPOSITORY = 1
+CONTENTS = 2
+CONTRIBUTORS = 3
+
+# Minimum seconds between two requests of the core bucket (0 means no pacing until the bucket runs dry)
+CORE_MIN_INTERVAL = float(os.environ.get('github_core_min_interval', '0'))
+# Requests a rate limited call is retried before giving up
+MAX_RETRIES = 3
+# Wait used for secondary rate limits when Github doesn't send a Retry-After header
+SECONDARY_RATE_LIMIT_WAIT = 60
+
+
+class BudgetExhausted(Exception):
+    # The remaining rate limit budget can't be used before the deadline. reason: "deadline" when the run is out of time,
+    # "quota" when the rate limit is used up until reset (Unix timestamp), after the deadline
+    def __init__(self, message, reason='deadline', reset=None):
+        super().__init__(message)
+        self.reason = reason
+        self.reset = reset
+
+
+class Bucket:
+    def __init__(self, name, min_interval=0.0):
+        self.name = name
+        self.limit = 0
+        self.remaining = 0
+        self.reset = 0.0
+        self.min_interval = min_interval
+        self.next_at = 0.0
+        self.waiting = []
+
+    def update(self, remaining, limit, reset):
+        if reset > self.reset:
+            # New rate limit window
+            self.remaining, self.limit, self.reset = remaining, limit, reset
+        else:
+            # Responses of concurrent requests come back out of order, the lowest count is the most recent
+            self.remaining = min(self.remaining, remaining)
+            self.limit = limit
+
+
+class Scheduler:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.buckets = {'core': Bucket('core', CORE_MIN_INTERVAL), 'search': Bucket('search'),
+                        'graphql': Bucket('graphql')}
+        self.deadline = None
+        self.sequence = 0
+        # Fan out workers scanning at the same time with the same token
+        self.workers = 1
+
+    def set_deadline(self, deadline):
+        # Unix timestamp after which no new request is started, None to run without a deadline
+        self.deadline = deadline
+
+    def set_workers(self, workers):
+        # The core bucket is shared through the response headers, but the search requests are paced locally: each of
+        # the workers only gets its share of the search window
+        self.workers = max(1, workers)
+
+    def refresh(self, g):
+        # GET /rate_limit doesn't count against the rate limit
+        rate_limit = g.get_rate_limit()
+        with self.condition:
+            for name, rate in (('core', rate_limit.core), ('search', rate_limit.search), ('graphql', rate_limit.graphql)):
+                bucket = self.buckets[name]
+                bucket.remaining, bucket.limit = rate.remaining, rate.limit
+                bucket.reset = calendar.timegm(rate.reset.timetuple())
+            search = self.buckets['search']
+            # Spread the search requests over the window instead of bursting into the secondary rate limits
+            search.min_interval = 60.0 * self.workers / search.limit if search.limit else 0.0
+            self.condition.notify_all()
+        logger.info(f"Rate limit: core {rate_limit.core.remaining}/{rate_limit.core.limit}, "
+                    f"search {rate_limit.search.remaining}/{rate_limit.search.limit}")
+        return rate_limit
+
+    def acquire(self, name, priority):
+        bucket = self.buckets[name]
+        with self.condition:
+            self.sequence += 1
+            entry = (priority, self.sequence)
+            heapq.heappush(bucket.waiting, entry)
+            try:
+                while True:
+                    now = time.time()
+                    if self.deadline is not None and now > self.deadline:
+                        raise BudgetExhausted("Deadline reached")
+                    if bucket.waiting[0] != entry:
+                        # A request with a higher priority goes first
+                        wait = None
+                    elif bucket.remaining <= 0 and now < bucket.reset:
+                        # add 1 second to be sure the rate limit has been reset
+                        wait = bucket.reset - now + 1
+                    elif bucket.remaining <= 0:
+                        # The window is over, the next response headers tell the real count
+                        bucket.remaining = max(bucket.limit, 1)
+                        continue
+                    elif now < bucket.next_at:
+                        wait = bucket.next_at - now
+                    else:
+                        bucket.remaining -= 1
+                        bucket.next_at = now + bucket.min_interval
+                        return
+                    if wait is not None and self.deadline is not None and now + wait > self.deadline:
+                        if bucket.remaining <= 0:
+                            raise BudgetExhausted(f"{bucket.name} rate limit can't be used before the deadline "
+                                                  f"({bucket.remaining}/{bucket.limit} remaining, reset in {int(bucket.reset - now)}s)",
+                                                  'quota', bucket.reset)
+                        raise BudgetExhausted(f"Deadline reached while waiting for the {bucket.name} rate limit")
+                    if wait is not None and wait > 1:
+                        logger.warning(f"Waiting {int(wait)}s for the {bucket.name} rate limit")
+                    started = time.time()
+                    self.condition.wait(wait)
+                    if wait is not None:
+                        instrumentation.add_time('rate_limit_sleep', time.time() - started)
+            finally:
+                bucket.waiting.remove(entry)
+                heapq.heapify(bucket.waiting)
+                self.condition.notify_all()
+
+    def update(self, name, remaining, limit, reset):
+        with self.condition:
+            self.buckets[name].update(remaining, limit, reset)
+
+    def update_from(self, name, client):
+        # PyGithub keeps the rate limit headers of the last response of each client
+        remaining, limit = client.rate_limiting
+        self.update(name, remaining, limit, client.rate_limiting_resettime)
+
+    def call(self, name, priority, function, *args, endpoint, client=None, **kwargs):
+        # endpoint: name of the request in the metrics (http.<endpoint>.*), the priority doesn't tell the endpoint apart
+        for attempt in range(MAX_RETRIES + 1):
+            self.acquire(name, priority)
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except RateLimitExceededException as e:
+                instrumentation.count(f"http.{endpoint}.rate_limited")
+                if attempt == MAX_RETRIES:
+                    raise
+                self.rate_limited(name, e)
+                continue
+            except GithubException as e:
+                if e.status != 403 or 'secondary rate limit' not in str(e.data).lower() or attempt == MAX_RETRIES:
+                    raise
+                instrumentation.count(f"http.{endpoint}.rate_limited")
+                self.rate_limited(name, e)
+                continue
+            finally:
+                # Failed requests (404...) count as well, they use the rate limit too
+                instrumentation.request(endpoint, time.perf_counter() - start)
+            if client is not None:
+                self.update_from(name, client)
+            return result
+
+    def rate_limited(self, name, e):
+        headers = e.headers or {}
+        bucket = self.buckets[name]
+        if headers.get('x-ratelimit-remaining') == '0':
+            # Primary rate limit: wait for the reset
+            with self.condition:
+                bucket.remaining = 0
+                bucket.reset = int(headers.get('x-ratelimit-reset', time.time() + 60))
+            logger.warning(f"{bucket.name} rate limit exceeded, reset at {bucket.reset}")
+            return
+        # Secondary rate limit: https://docs.github.com/en/rest/guides/best-practices-for-integrators#dealing-with-secondary-rate-limits
+        wait = int(headers.get('retry-after', SECONDARY_RATE_LIMIT_WAIT))
+        if self.deadline is not None and time.time() + wait > self.deadline:
+            raise BudgetExhausted(f"Secondary rate limit, retry after {wait}s is past the deadline", 'quota',
+                                  time.time() + wait)
+        logger.warning(f"Secondary rate limit hit, retrying in {wait}s")
+        with self.condition:
+            bucket.next_at = max(bucket.next_at, time.time() + wait)
+
+
+# Shared by all the Github clients of the run
+scheduler = Scheduler()
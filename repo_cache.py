@@ -0,0 +1,147 @@
+from rate_limiter import scheduler
+from github import UnknownObjectException
+import rate_limiter
+import enrichment
+import threading
+import logging
+import cache_db
+import json
+import time
+import os
+
+logger = logging.getLogger()
+
+# Repository metadata (archived flag, org name, url, top contributors) is looked up once per repository and run.
+# The entries are also kept in the SQLite cache (see cache_db) so warm Lambda containers and back to back runs can
+# reuse them until repo_cache_ttl (seconds) runs out.
+CACHE_TTL = int(os.environ.get('repo_cache_ttl', '86400'))
+
+exclude_list = ['None', 'rv-container-pipeline', 'bot']
+# Organization of the rows when the org has no display name (or the repository is owned by a user). Organization is part of the primary key, an empty value
+# would be loaded as NULL and fail the COPY. Same value as the rows loaded before the sinks.
+NO_ORGANIZATION = 'None'
+
+repos = {}
+org_names = {}
+cache_lock = threading.Lock()
+repo_locks = {}
+
+
+def top_contributors(repository, client):
+    # Pages are fetched one at a time through the scheduler, usually the first page has 3 contributors
+    contri_list = []
+    contributors = repository.get_contributors()
+    page = 0
+    while len(contri_list) < 3:
+        logins = scheduler.call('core', rate_limiter.CONTRIBUTORS, contributors.get_page, page, endpoint='contributors',
+                                client=client)
+        if not logins:
+            break
+        for t in logins:
+            if not any(x in t.login for x in exclude_list):
+                contri_list.append(str(t.login))
+                if len(contri_list) == 3:
+                    break
+        page += 1
+    if not contri_list:
+        contri_list.append('None')
+    return ';'.join(contri_list)
+
+
+def organization_name(organization, client):
+    # Most repositories belong to a handful of orgs, so the org lookup is cached by login as well
+    with cache_lock:
+        if organization.login in org_names:
+            return org_names[organization.login]
+    name = scheduler.call('core', rate_limiter.REPOSITORY, lambda: organization.name, endpoint='organization',
+                          client=client)
+    if name is None:
+        name = NO_ORGANIZATION
+    with cache_lock:
+        org_names[organization.login] = name
+    return name
+
+
+def fetch_repo_info(token, full_name):
+    # https://pygithub.readthedocs.io/en/latest/github_objects/Repository.html#github.Repository.Repository
+    client = enrichment.thread_github(token)
+    repository = scheduler.call('core', rate_limiter.REPOSITORY, client.get_repo, full_name, endpoint='repository',
+                                client=client)
+    info = {'archived': repository.archived, 'name': repository.name, 'url': repository.html_url,
+            'organization': None, 'contributors': None}
+    # Archived repositories are skipped, no need to look up their org or contributors
+    if repository.archived is False:
+        # organization is None for the repositories of users
+        if repository.organization is None:
+            info['organization'] = NO_ORGANIZATION
+        else:
+            info['organization'] = organization_name(repository.organization, client)
+        info['contributors'] = top_contributors(repository, client)
+    return info
+
+
+def complete_repo_info(token, full_name, metadata):
+    # Metadata fetched with GraphQL (see github_graphql), the contributors are only available through REST
+    info = dict(metadata, contributors=None)
+    if info['archived'] is False:
+        client = enrichment.thread_github(token)
+        info['contributors'] = top_contributors(client.get_repo(full_name, lazy=True), client)
+    store_repo_info(full_name, info)
+    return info
+
+
+def cached_repo_info(full_name):
+    # Entry of the current run or of the SQLite cache, None when the repository has to be fetched
+    with cache_lock:
+        if full_name in repos:
+            return repos[full_name]
+    cached = cache_db.query("SELECT info FROM repo_cache WHERE full_name = ? AND fetched_at >= ?",
+                            (full_name, time.time() - CACHE_TTL))
+    if cached:
+        with cache_lock:
+            repos[full_name] = json.loads(cached[0][0])
+            return repos[full_name]
+    return None
+
+
+def store_repo_info(full_name, info):
+    with cache_lock:
+        repos[full_name] = info
+    cache_db.execute("INSERT OR REPLACE INTO repo_cache (full_name, info, fetched_at) VALUES (?, ?, ?)",
+                     (full_name, json.dumps(info), time.time()))
+
+
+def get_repo_info(token, full_name):
+    with cache_lock:
+        if full_name in repos:
+            return repos[full_name]
+        # One lock per repository so files of the same repo that are looked up at the same time wait for the first
+        # lookup instead of all hitting the API
+        repo_lock = repo_locks.setdefault(full_name, threading.Lock())
+
+    with repo_lock:
+        info = cached_repo_info(full_name)
+        if info is None:
+            try:
+                info = fetch_repo_info(token, full_name)
+            except UnknownObjectException:
+                # Deleted or no longer accessible since the search index was built: its files have no rows, same as
+                # with GraphQL. Only kept for the run (its other files aren't looked up again), the next run looks it
+                # up again.
+                logger.info(f"Repository {full_name} not found, skipping its files")
+                with cache_lock:
+                    repos[full_name] = None
+                return None
+            store_repo_info(full_name, info)
+        return info
+
+
+def reset():
+    # Drop the in-memory entries at the start of a run, the SQLite entries stay until their TTL runs out
+    with cache_lock:
+        repos.clear()
+        org_names.clear()
+        repo_locks.clear()
+    cache_db.execute("CREATE TABLE IF NOT EXISTS repo_cache (full_name TEXT PRIMARY KEY, info TEXT, fetched_at REAL)")
+    # TTL eviction
+    cache_db.execute("DELETE FROM repo_cache WHERE fetched_at < ?", (time.time() - CACHE_TTL,))
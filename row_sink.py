@@ -0,0 +1,188 @@
+import threading
+import operator
+import datetime
+import logging
+import csv
+import os
+
+logger = logging.getLogger()
+
+# Columns of the db table, in the order the rows are produced
+FIELDS = ["Date", "Organization", "Repository", "Filename", "Registry", "Image", "ImageLang", "Version", "RepoURL",
+          "PipelineImage", "TopContributors"]
+
+# Low cardinality columns, dictionary encoded in the Parquet snapshots
+DICTIONARY_COLUMNS = ["Organization", "Registry", "ImageLang", "PipelineImage"]
+# Rows of a Parquet row group, only that many rows per date are held in memory
+ROW_GROUP_SIZE = int(os.environ.get('snapshot_row_group_size', '10000'))
+
+# Set debug_table to print the rows as a pretty table at the end of the run (keeps every row in memory)
+DEBUG_TABLE = os.environ.get('debug_table', '').lower() in ('1', 'true', 'yes')
+
+
+class CsvSink:
+    # Writes every row to a CSV file as soon as it is produced
+    def __init__(self, path='/tmp/output.csv'):
+        self.path = path
+        self.rows = 0
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(FIELDS)
+
+    def add_row(self, row):
+        self.writer.writerow(row)
+        self.rows += 1
+
+    def close(self):
+        self.file.close()
+
+
+class CopySink:
+    # Streams the rows straight into a Postgres table: COPY ... FROM STDIN reads the CSV from a pipe in a background
+    # thread while the scan writes to the other end, so the rows are never held in memory or written to /tmp
+    # https://www.psycopg.org/docs/cursor.html#cursor.copy_expert
+    def __init__(self, cur, table):
+        self.table = table
+        self.rows = 0
+        # Rows COPY reports, set once the COPY is over
+        self.copied = None
+        self.error = None
+        read_fd, write_fd = os.pipe()
+        self.reader = os.fdopen(read_fd, 'r')
+        self.file = os.fdopen(write_fd, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.thread = threading.Thread(target=self.copy, args=(cur,), daemon=True)
+        self.thread.start()
+
+    def copy(self, cur):
+        try:
+            cur.copy_expert(f"COPY {self.table} ({', '.join(FIELDS)}) FROM STDIN WITH (FORMAT csv)", self.reader)
+            self.copied = cur.rowcount
+        except Exception as e:
+            self.error = e
+        finally:
+            # Closing the read end makes a blocked writer fail with BrokenPipeError instead of hanging
+            self.reader.close()
+
+    def add_row(self, row):
+        try:
+            self.writer.writerow(row)
+        except BrokenPipeError:
+            raise RuntimeError(f"COPY into {self.table} failed: {self.error}")
+        self.rows += 1
+
+    def close(self):
+        try:
+            self.file.close()
+        except BrokenPipeError:
+            pass
+        self.thread.join()
+        if self.error is not None:
+            raise RuntimeError(f"COPY into {self.table} failed: {self.error}")
+
+
+class ParquetSink:
+    # Columnar snapshot of the rows: a zstd compressed Parquet file per date, in Hive style day=YYYY-MM-DD directories
+    # under directory (not Date=, the partition column would clash with the Date column), written a row group at a
+    # time. Only the low cardinality columns are dictionary encoded, the others (Filename, RepoURL...) barely repeat.
+    # https://arrow.apache.org/docs/python/parquet.html
+    def __init__(self, directory, name, ordered=False):
+        # Only imported when the snapshots are turned on, pyarrow isn't in requirements.txt (raises ImportError)
+        import pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.directory = directory
+        self.name = name
+        # ordered: the rows come sorted by date, the file of a date is closed as soon as the next date starts
+        self.ordered = ordered
+        self.rows = 0
+        self.schema = pyarrow.schema([("Date", pyarrow.date32())] + [(field, pyarrow.string()) for field in FIELDS[1:]])
+        self.dates = {}
+        self.buffers = {}
+        self.writers = {}
+        # Files written, once closed
+        self.paths = []
+
+    def date(self, value):
+        # Scanned rows carry the date as MM-DD-YYYY, rows read back from the db table as a datetime
+        if value not in self.dates:
+            if isinstance(value, str):
+                self.dates[value] = datetime.datetime.strptime(value, '%m-%d-%Y').date()
+            else:
+                self.dates[value] = value.date() if isinstance(value, datetime.datetime) else value
+        return self.dates[value]
+
+    def add_row(self, row):
+        date = self.date(row[0])
+        if self.ordered and date not in self.buffers:
+            # Every earlier date, a day of rows usually doesn't fill a row group and has no writer yet
+            for other in list(self.buffers):
+                self.finish(other)
+        buffer = self.buffers.setdefault(date, [])
+        buffer.append([date] + list(row[1:]))
+        self.rows += 1
+        if len(buffer) >= ROW_GROUP_SIZE:
+            self.flush(date)
+
+    def flush(self, date):
+        rows = self.buffers.get(date)
+        if not rows:
+            return
+        if date not in self.writers:
+            path = os.path.join(self.directory, f"day={date.isoformat()}", f"{self.name}.parquet")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.writers[date] = (path, self.pyarrow.parquet.ParquetWriter(
+                path, self.schema, compression='zstd', use_dictionary=DICTIONARY_COLUMNS))
+        columns = [self.pyarrow.array(column, type=self.schema.field(i).type) for i, column in enumerate(zip(*rows))]
+        self.writers[date][1].write_table(self.pyarrow.Table.from_arrays(columns, schema=self.schema))
+        self.buffers[date] = []
+
+    def finish(self, date):
+        self.flush(date)
+        self.buffers.pop(date, None)
+        if date in self.writers:
+            path, writer = self.writers.pop(date)
+            writer.close()
+            self.paths.append(path)
+
+    def close(self):
+        for date in list(self.buffers):
+            self.finish(date)
+
+
+class TableSink:
+    # Debug renderer only, keeps every row to print them sorted by organization and repository
+    def __init__(self):
+        # Only imported when the debug table is turned on
+        from prettytable import PrettyTable
+        self.rows = 0
+        self.table = PrettyTable()
+        self.table.field_names = FIELDS
+
+    def add_row(self, row):
+        self.table.add_row(row)
+        self.rows += 1
+
+    def close(self):
+        print(self.table.get_string(sort_key=operator.itemgetter(1, 2), sortby="Organization"))
+
+
+class TeeSink:
+    def __init__(self, *sinks):
+        self.sinks = sinks
+        self.rows = 0
+
+    def add_row(self, row):
+        for sink in self.sinks:
+            sink.add_row(row)
+        self.rows += 1
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+def with_debug_table(sink):
+    if DEBUG_TABLE:
+        return TeeSink(sink, TableSink())
+    return sink
@@ -0,0 +1,360 @@
+from rate_limiter import scheduler
+from collections import namedtuple
+import enrichment
+import repo_cache
+import file_index
+import cache_db
+import row_sink
+import dockerfile_parser
+import github_graphql
+import query_partitioner
+import rate_limiter
+import instrumentation
+import re
+import logging
+import time
+import secrets_cache
+import math
+import os
+
+# Logging https://dev.to/aws-builders/why-you-should-never-ever-print-in-a-lambda-function-3i37
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO)  # To see output in local console
+logger.setLevel(logging.INFO)  # To see output in Lambda
+
+# Variables
+image_lang_list = os.environ['image_lang_list']
+image_langs = list(image_lang_list.replace(' ', '').split(","))
+# pattern = \b(alpine|dotnet|golang|java|jdk|jre|node|php|python)\b
+image_lang_pattern = re.compile(r'\b({})\b'.format('|'.join(map(re.escape, image_langs))))
+java_langs = [lang for lang in image_langs if lang in ('java', 'jdk', 'jre')]
+# jdk also matches inside a word (openjdk, adoptopenjdk), java and jre only as a word (not javascript, jrebel)
+java_pattern = re.compile('|'.join(lang if lang == 'jdk' else rf'\b{lang}\b' for lang in java_langs)) if java_langs else None
+# Parsed images of a Dockerfile in the file index, the images depend on image_lang_list and on the patterns above
+IMAGES_KIND = f"images:v3:{','.join(image_langs)}"
+
+# Registries that serve the container pipeline images and how they show up in the Registry column
+pipeline_registries = {
+    'redventures-container-pipeline-docker.jfrog.io': 'Artifactory',
+    '089022728777.dkr.ecr.us-east-1.amazonaws.com': 'ECR',
+    'gcr.io/rv-base-images': 'GCR',
+}
+
+PER_PAGE = 30
+
+# How the Dockerfiles and repository metadata are fetched: "rest" (PyGithub, a few requests per file) or "graphql"
+# (a single query per page of search results, see github_graphql)
+FETCH_BACKEND = os.environ.get('fetch_backend', 'rest')
+
+# Which rows a search produces: pipeline images ("Yes"), non pipeline images ("No") or both
+PIPELINE = frozenset(["Yes"])
+NON_PIPELINE = frozenset(["No"])
+ALL_IMAGES = PIPELINE | NON_PIPELINE
+
+# query: Github code search query, pipeline_images: rows kept for the files it finds
+Search = namedtuple('Search', ['query', 'pipeline_images'])
+
+
+def github_token():
+    # Fetched on first use and cached per container (see secrets_cache)
+    return secrets_cache.parameter(os.environ['github_token'])
+
+
+def image_lang_of(name):
+    # java, jdk and jre images all count as java (openjdk, maven-jre...). Only the image name is matched, not the tag:
+    # eclipse-temurin:17-jre isn't a java image here. php images are often alpine based so php wins over the other
+    # matches
+    match = image_lang_pattern.search(name)
+    if java_pattern is not None and java_pattern.search(name):
+        return "java"
+    if match is None:
+        return None
+    if 'php' in name:
+        return "php"
+    return match.group(1)
+
+
+def classify_images(content):
+    # Looks at every FROM line of the Dockerfile once: images from one of the pipeline registries are pipeline images,
+    # other images matching image_lang_list are non pipeline images
+    file_images = []
+    for ref in dockerfile_parser.parse_images(content):
+        name = dockerfile_parser.image_name(ref)
+        version = ref.tag or ref.digest or "latest"
+        for registry, source in pipeline_registries.items():
+            if name.startswith(registry + '/'):
+                image = name[len(registry) + 1:].split('/')[0]  # first path component after the registry
+                image_lang = image.split('-')[1] if '-' in image else image
+                image_row = [source, image, image_lang, version, "Yes"]
+                break
+        else:
+            image_lang = image_lang_of(name)
+            if image_lang is None:
+                continue
+            image_row = ["N/A", name, image_lang, version, "No"]
+        if image_row not in file_images:  # To get unique images in the Dockerfile
+            file_images.append(image_row)
+    return file_images
+
+
+def file_rows_of(file, repo_info, file_images, pipeline_images):
+    file_rows = []
+    date = time.strftime('%m-%d-%Y')
+    url = repo_info['url']
+    repo = repo_info['name']
+    # Entries cached before the organization fallback can still have None
+    organization = repo_info['organization'] or repo_cache.NO_ORGANIZATION
+    contributors = repo_info['contributors']
+    for source, image, image_lang, version, pipeline_image in file_images:
+        if pipeline_image in pipeline_images:
+            file_rows.append([date, organization, repo, file.path, source, image, image_lang, version, url,
+                              pipeline_image, contributors])
+    return file_rows
+
+
+def scanned(repo_info):
+    # https://pygithub.readthedocs.io/en/latest/github_objects/Repository.html#github.Repository.Repository
+    return repo_info['archived'] is False and repo_info['name'] != 'container-image-pipeline'
+
+
+def process_file(file, pipeline_images):
+    file_rows = []
+    token = github_token()
+    repo_info = repo_cache.get_repo_info(token, file.repository.full_name)
+    # None: the repository was deleted since the search index was built (404)
+    if repo_info is not None and scanned(repo_info):
+        filename = file.path
+        # The search result carries the blob SHA, unchanged Dockerfiles reuse the images parsed in a previous run
+        file_images = file_index.get_images(IMAGES_KIND, file.repository.full_name, filename, file.sha)
+        if file_images is None:
+            try:
+                # The search results files that no longer exist, but repository.get_contents will throw 404: not found error, to fix this we have to ignore such files and move to the next item in the loop
+                # For ex: Code was trying to look into the contents of Dockerfile (which doesn't exist) in https://github.com/RedVentures/can-feed-api
+                # 404 {"message": "Not Found", "documentation_url": "https://docs.github.com/rest/reference/repos#get-repository-content"}
+                repository = enrichment.thread_repository(token, file)
+                file_content = scheduler.call('core', rate_limiter.CONTENTS, repository.get_contents, filename,
+                                              endpoint='contents', client=enrichment.thread_github(token))
+            except rate_limiter.BudgetExhausted:
+                raise
+            except Exception:
+                return file_rows
+            instrumentation.count('bytes_downloaded', file_content.size, 'Bytes')
+            content = file_content.decoded_content.decode()
+            file_images = classify_images(content)
+            file_index.put_images(IMAGES_KIND, file.repository.full_name, filename, file.sha, file_images)
+        file_rows = file_rows_of(file, repo_info, file_images, pipeline_images)
+    return file_rows
+
+
+def process_files_graphql(entries, executor=None):
+    # Same rows as process_file for a page of (file, pipeline_images), with everything missing from the caches fetched
+    # in GraphQL batches. Returns the rows of each file in order.
+    repo_infos = {}
+    for file, pipeline_images in entries:
+        if file.repository.full_name not in repo_infos:
+            repo_infos[file.repository.full_name] = repo_cache.cached_repo_info(file.repository.full_name)
+    images = [file_index.get_images(IMAGES_KIND, file.repository.full_name, file.path, file.sha)
+              for file, pipeline_images in entries]
+    missing_repos = [full_name for full_name, repo_info in repo_infos.items() if repo_info is None]
+    # Files of repositories already known to be skipped (archived...) aren't fetched
+    missing_files = [(file.repository.full_name, file.path)
+                     for (file, pipeline_images), file_images in zip(entries, images)
+                     if file_images is None and (repo_infos[file.repository.full_name] is None or
+                                                 scanned(repo_infos[file.repository.full_name]))]
+    texts = {}
+    if missing_repos or missing_files:
+        token = github_token()
+        metadata, texts = github_graphql.fetch(token, missing_repos, missing_files)
+        found = [full_name for full_name in missing_repos if metadata[full_name] is not None]
+        # Contributors of the new repositories over REST, concurrently
+        for full_name, repo_info in zip(found, enrichment.enrich_files(
+                found, lambda full_name: repo_cache.complete_repo_info(token, full_name, metadata[full_name]),
+                executor=executor)):
+            repo_infos[full_name] = repo_info
+
+    results = []
+    for (file, pipeline_images), file_images in zip(entries, images):
+        repo_info = repo_infos[file.repository.full_name]
+        if repo_info is None or not scanned(repo_info):
+            results.append([])
+            continue
+        if file_images is None:
+            key = (file.repository.full_name, file.path)
+            if key not in texts:
+                # Too big for GraphQL
+                results.append(process_file(file, pipeline_images))
+                continue
+            if texts[key] is None:
+                # Deleted since it was indexed, no rows like a 404 with REST
+                results.append([])
+                continue
+            file_images = classify_images(texts[key])
+            file_index.put_images(IMAGES_KIND, file.repository.full_name, file.path, file.sha, file_images)
+        results.append(file_rows_of(file, repo_info, file_images, pipeline_images))
+    return results
+
+
+def search_pages(search, first_page=0):
+    # Yields (page number, files) for the pages of the search results starting at first_page
+    # https://www.thepythoncode.com/article/using-github-api-in-python
+    # https://www.techgeekbuzz.com/how-to-use-github-api-in-python/
+    # login with access token
+    g = enrichment.thread_github(github_token())
+    result = g.search_code(search.query, order='desc')
+    if search.query in query_partitioner.first_pages:
+        # Already fetched while partitioning the search
+        total_count, page_zero = query_partitioner.first_pages.pop(search.query)
+    else:
+        # https://github.com/PyGithub/PyGithub/issues/1309
+        page_zero = scheduler.call('search', rate_limiter.SEARCH, result.get_page, 0, endpoint='search', client=g)
+        total_count = result.totalCount if page_zero else 0
+    print(f'Found {total_count} Dockerfiles for {search.query}')
+
+    if total_count > query_partitioner.SEARCH_RESULT_LIMIT:
+        print(f"Limiting results to {query_partitioner.SEARCH_RESULT_LIMIT}")
+    last_page = int(math.ceil(min(total_count, query_partitioner.SEARCH_RESULT_LIMIT) / PER_PAGE))
+
+    print(f"Parsing info from results in pages {first_page}-{last_page}")
+    for i in range(first_page, last_page):
+        if i == 0:
+            # Already fetched for totalCount
+            page = page_zero
+        else:
+            page = scheduler.call('search', rate_limiter.SEARCH, result.get_page, i, endpoint='search', client=g)
+        if not page:
+            break
+        yield i, page
+
+
+def new_checkpoint(searches):
+    # partitions: searches split under the search result limit, search/page: cursor of the next partition page to scan,
+    # processed: files already scanned and the rows they produced
+    return {'queries': [search.query for search in searches], 'partitions': None, 'search': 0, 'page': 0,
+            'processed': {}, 'created': time.time()}
+
+
+def partition_searches(searches):
+    # Searches with more results than the search API returns are split in narrower searches. The partitions can
+    # overlap (and a file can move between size ranges during the scan), the processed files of the checkpoint keep
+    # the rows unique.
+    partitions = []
+    for search in searches:
+        for query in query_partitioner.partition(github_token(), search.query):
+            partitions.append([query, sorted(search.pipeline_images)])
+    return partitions
+
+
+def scan(searches, sink=None, checkpoint=None, backend=None):
+    # https://python.gotrained.com/search-github-api/
+    # Scans page by page and keeps its progress in the checkpoint, so a scan stopped by the deadline can resume where
+    # it left off. Returns a summary of the scan, complete is False when it stopped before the end: stop_reason
+    # "deadline" when it ran out of time, "quota" when the rate limit is used up until rate_limit_reset.
+    backend = backend or FETCH_BACKEND
+    if backend not in ('rest', 'graphql'):
+        raise ValueError(f"Unknown fetch backend {backend}")
+    rows = 0
+    processed = 0
+    complete = True
+    stop_reason = None
+    rate_limit_reset = None
+    if checkpoint is None or checkpoint['queries'] != [search.query for search in searches]:
+        checkpoint = new_checkpoint(searches)
+    elif checkpoint['search'] or checkpoint['page']:
+        print(f"Resuming scan at search {checkpoint['search']}, page {checkpoint['page']} "
+              f"({len(checkpoint['processed'])} Dockerfiles already processed)")
+    scheduler.refresh(enrichment.thread_github(github_token()))
+
+    # Rows are streamed to the sink as they are produced. Without a sink they go to /tmp/output.csv
+    close_sink = sink is None
+    if sink is None:
+        sink = row_sink.with_debug_table(row_sink.CsvSink('/tmp/output.csv'))
+    cache_db.pull()
+    repo_cache.reset()
+    file_index.init(IMAGES_KIND)
+
+    def process(entry):
+        return process_file(entry[0], pipeline_images=entry[1])
+
+    # A single thread pool for all the pages of the scan
+    executor = enrichment.executor()
+    # First pages left by an earlier run of the warm container (or by the partitioning of a coordinator) are stale, only
+    # the ones probed by this scan are used
+    query_partitioner.first_pages.clear()
+    try:
+        if checkpoint.get('partitions') is None:
+            with instrumentation.stage('partition'):
+                checkpoint['partitions'] = partition_searches(searches)
+        partitions = [Search(query, frozenset(pipeline_images)) for query, pipeline_images in checkpoint['partitions']]
+        for search_index in range(checkpoint['search'], len(partitions)):
+            search = partitions[search_index]
+            for page_number, page in search_pages(search, checkpoint['page']):
+                # The same Dockerfile often shows up in more than one search (pipeline registry and org searches),
+                # it only produces the rows the earlier searches didn't already produce
+                entries = []
+                for file in page:
+                    key = f"{file.repository.full_name}:{file.path}"
+                    done = frozenset(checkpoint['processed'].get(key, []))
+                    if search.pipeline_images - done:
+                        entries.append((file, search.pipeline_images - done, key, done))
+
+                # The results of enrich_files come in while they are consumed, the loop is part of the stage
+                with instrumentation.stage('files'):
+                    if backend == 'graphql':
+                        results = process_files_graphql([(entry[0], entry[1]) for entry in entries], executor)
+                    else:
+                        # Look up the files concurrently, the rows come back in the order of the search results
+                        results = enrichment.enrich_files(entries, process, executor=executor)
+                    for entry, file_rows in zip(entries, results):
+                        processed += 1
+                        for row in file_rows:
+                            rows += 1
+                            sink.add_row(row)
+                        file, pipeline_images, key, done = entry
+                        checkpoint['processed'][key] = sorted(pipeline_images | done)
+                checkpoint['page'] = page_number + 1
+            checkpoint['search'] = search_index + 1
+            checkpoint['page'] = 0
+    except rate_limiter.BudgetExhausted as e:
+        # Keep what was found so far instead of running into the Lambda timeout, the checkpoint tells where to resume
+        complete = False
+        stop_reason, rate_limit_reset = e.reason, e.reset
+        logger.warning(f"Stopping the scan early: {e}")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if close_sink:
+        sink.close()
+    logger.info(f'No. of row(s) produced: {rows}, Dockerfiles processed: {processed}')
+    logger.info(f"Time spent waiting for the rate limit (all threads): "
+                f"{int(instrumentation.summary().get('rate_limit_sleep', 0))}s")
+    instrumentation.count('rows_produced', rows)
+    instrumentation.count('files_processed', processed)
+
+    file_index.log_stats()
+    file_index.touch_reused()
+    # Keep the repository cache and file index for the next run
+    cache_db.push()
+    return {'rows': rows, 'files_processed': processed, 'complete': complete, 'stop_reason': stop_reason,
+            'rate_limit_reset': rate_limit_reset, 'checkpoint': checkpoint}
+
+
+def registry_searches(keywords, pipeline_images=PIPELINE):
+    # Github code search splits on '-' and '/', so the registry keywords are passed with spaces
+    keywords = [keyword.strip() for keyword in keywords.split(',')]
+    return [Search(f'"{keyword}" filename:Dockerfile', pipeline_images) for keyword in keywords]
+
+
+def org_searches(org_list, pipeline_images=ALL_IMAGES, keywords="FROM "):
+    orgs = list(org_list.replace(' ', '').split(","))
+    print(f"Organizations: {orgs}")
+    return [Search(f'"{keywords}" org:{org} filename:Dockerfile', pipeline_images) for org in orgs]
+
+
+def search_github(keywords, org_list, sink=None, checkpoint=None, backend=None):
+    # Single pass over org searches and pipeline registry searches: every Dockerfile is fetched once and each FROM
+    # line is classified as a pipeline or non pipeline image. The org searches go first, they produce both kinds of
+    # rows so the registry searches only have to look at Dockerfiles outside of the orgs.
+    logger.info(keywords)
+    print(f"Image lang list: {image_langs}")
+    return scan(org_searches(org_list) + registry_searches(keywords), sink, checkpoint, backend)
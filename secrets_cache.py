@@ -0,0 +1,42 @@
+from botocore.config import Config
+import threading
+import logging
+import boto3
+import time
+import os
+
+logger = logging.getLogger()
+
+# boto3 clients and SSM parameters shared by all the modules. They are created/fetched on first use instead of at
+# import time and kept for the life of the (warm) Lambda container. Parameters are fetched again after secrets_ttl
+# seconds so a rotated Github token or db password is picked up without a cold start.
+SECRETS_TTL = int(os.environ.get('secrets_ttl', '3600'))
+
+lock = threading.Lock()
+clients = {}
+parameters = {}
+
+
+def client(service, read_timeout=None):
+    # boto3's default session isn't thread safe, the clients are created under the lock (and are thread safe after that).
+    # read_timeout: for calls that take longer than the default 60s (synchronous Lambda invocations), such a call isn't
+    # retried since it would run twice
+    key = (service, read_timeout)
+    with lock:
+        if key not in clients:
+            config = Config(read_timeout=read_timeout, retries={'total_max_attempts': 1}) if read_timeout else None
+            clients[key] = boto3.client(service, config=config)
+        return clients[key]
+
+
+def parameter(name):
+    # Decrypted SSM parameter, cached for SECRETS_TTL seconds
+    now = time.time()
+    with lock:
+        if name in parameters and now - parameters[name][1] < SECRETS_TTL:
+            return parameters[name][0]
+    value = client('ssm').get_parameter(Name=name, WithDecryption=True)['Parameter']['Value']
+    with lock:
+        parameters[name] = (value, now)
+    logger.info(f"Fetched parameter {name}")
+    return value
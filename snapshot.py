@@ -0,0 +1,60 @@
+import secrets_cache
+import row_sink
+import logging
+import os
+
+logger = logging.getLogger()
+
+# Parquet snapshots of the rows of every run (snapshot=true), partitioned by date: a few MB per day instead of a CSV
+# that is thrown away after the load, and bulk analytics or backfills read them instead of the growing db table.
+# They are written to snapshot_dir during the run and, once the rows are committed, moved to snapshot_bucket when it is
+# set (s3://<snapshot_bucket>/snapshots/<table>/day=YYYY-MM-DD/<run>.parquet). A resumed scan or a second run of the
+# day adds a file to the partition of the day.
+# pyarrow is optional: it is too big for the requirements of every run (use a Lambda layer that has it), without it the
+# runs go on without snapshots.
+SNAPSHOT = os.environ.get('snapshot', 'false').lower() == 'true'
+SNAPSHOT_BUCKET = os.environ.get('snapshot_bucket', '')
+SNAPSHOT_PREFIX = 'snapshots/'
+SNAPSHOT_DIR = os.environ.get('snapshot_dir', '/tmp/snapshots')
+
+
+def sink(table, name, ordered=False, required=False):
+    # ParquetSink of a run, None when the snapshots are turned off or pyarrow isn't installed
+    if not (SNAPSHOT or required):
+        return None
+    try:
+        return row_sink.ParquetSink(os.path.join(SNAPSHOT_DIR, table), name, ordered)
+    except ImportError:
+        if required:
+            raise
+        logger.warning("snapshot is turned on but pyarrow isn't installed, no Parquet snapshot for this run")
+        return None
+
+
+def publish(parquet_sink):
+    # Once the rows are committed (the sink is closed). Returns the snapshot files and their total size.
+    files = []
+    size = 0
+    for path in parquet_sink.paths:
+        relative = os.path.relpath(path, SNAPSHOT_DIR)
+        size += os.path.getsize(path)
+        if SNAPSHOT_BUCKET:
+            key = f"{SNAPSHOT_PREFIX}{relative}"
+            secrets_cache.client('s3').upload_file(path, SNAPSHOT_BUCKET, key)
+            os.remove(path)
+            files.append(f"s3://{SNAPSHOT_BUCKET}/{key}")
+        else:
+            files.append(path)
+    logger.info(f"Wrote {parquet_sink.rows} row(s) to {len(files)} Parquet snapshot file(s), {size} bytes")
+    return {'snapshot_files': files, 'snapshot_bytes': size}
+
+
+def discard(parquet_sink):
+    # The load failed, the snapshot would have rows the db table doesn't have
+    try:
+        parquet_sink.close()
+    except Exception:
+        pass
+    for path in parquet_sink.paths + [path for path, writer in parquet_sink.writers.values()]:
+        if os.path.exists(path):
+            os.remove(path)
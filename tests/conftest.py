@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules are at the top of the repository, scan_engine reads image_lang_list at import
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('image_lang_list', 'alpine, dotnet, golang, java, jdk, jre, node, php, python')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
@@ -0,0 +1,54 @@
+import pytest
+
+from dockerfile_parser import ImageRef, image_name, parse_images, parse_reference
+
+
+@pytest.mark.parametrize('content, expected', [
+    ("FROM python:3.9-slim\n", [ImageRef('', 'python', '3.9-slim', '', '', '')]),
+    ("from node\n", [ImageRef('', 'node', '', '', '', '')]),
+    # Line continuations
+    ("FROM \\\n  golang:1.16 \\\n  AS build\n", [ImageRef('', 'golang', '1.16', '', 'build', '')]),
+    ("FROM \\  \r\n alpine:3.14\n", [ImageRef('', 'alpine', '3.14', '', '', '')]),
+    # --platform
+    ("FROM --platform=linux/amd64 node:14\n", [ImageRef('', 'node', '14', '', '', 'linux/amd64')]),
+    ("ARG TARGET=linux/arm64\nFROM --platform=$TARGET node:14\n", [ImageRef('', 'node', '14', '', '', 'linux/arm64')]),
+    # Stage aliases: FROM an earlier stage (any case) and scratch are not images
+    ("FROM golang:1.16 AS Build\nFROM build\nFROM scratch\n", [ImageRef('', 'golang', '1.16', '', 'Build', '')]),
+    ("FROM golang:1.16 as build\nFROM alpine:3.14 AS final\n",
+     [ImageRef('', 'golang', '1.16', '', 'build', ''), ImageRef('', 'alpine', '3.14', '', 'final', '')]),
+    # ARG substitution, only the ARGs before the first FROM
+    ("ARG BASE=python\nARG TAG=3.10\nFROM ${BASE}:$TAG\n", [ImageRef('', 'python', '3.10', '', '', '')]),
+    ("FROM ${BASE:-node}:${TAG:-14}\n", [ImageRef('', 'node', '14', '', '', '')]),
+    ("ARG TAG=3.10\nFROM python:${TAG:+slim}\n", [ImageRef('', 'python', 'slim', '', '', '')]),
+    ("FROM alpine\nARG TAG=3.14\nFROM python:${TAG:-3.9}\n",
+     [ImageRef('', 'alpine', '', '', '', ''), ImageRef('', 'python', '3.9', '', '', '')]),
+    # Digests
+    ("FROM python@sha256:3f1a2b\n", [ImageRef('', 'python', '', 'sha256:3f1a2b', '', '')]),
+    ("FROM python:3.9@sha256:3f1a2b\n", [ImageRef('', 'python', '3.9', 'sha256:3f1a2b', '', '')]),
+    # Registry ports
+    ("FROM localhost:5000/team/app:1.0\n", [ImageRef('localhost:5000', 'team/app', '1.0', '', '', '')]),
+    ("FROM registry.example.com:8443/app\n", [ImageRef('registry.example.com:8443', 'app', '', '', '', '')]),
+    # Comments and other instructions
+    ("# FROM ubuntu\nRUN echo FROM ubuntu\nFROM php:7.4 # comment\n", [ImageRef('', 'php', '7.4', '', '', '')]),
+])
+def test_parse_images(content, expected):
+    assert parse_images(content) == expected
+
+
+@pytest.mark.parametrize('reference, expected', [
+    ('python', ('', 'python', '', '')),
+    ('library/python:3.9', ('', 'library/python', '3.9', '')),
+    ('gcr.io/rv-base-images/python:3.9', ('gcr.io', 'rv-base-images/python', '3.9', '')),
+    ('localhost/app', ('localhost', 'app', '', '')),
+    ('localhost:5000/app@sha256:abc', ('localhost:5000', 'app', '', 'sha256:abc')),
+])
+def test_parse_reference(reference, expected):
+    assert parse_reference(reference) == expected
+
+
+@pytest.mark.parametrize('ref, expected', [
+    (ImageRef('', 'python', '3.9', '', '', ''), 'python'),
+    (ImageRef('localhost:5000', 'team/app', '1.0', '', '', ''), 'localhost:5000/team/app'),
+])
+def test_image_name(ref, expected):
+    assert image_name(ref) == expected
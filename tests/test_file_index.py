@@ -0,0 +1,39 @@
+import sqlite3
+import time
+
+import pytest
+
+import cache_db
+import file_index
+
+
+@pytest.fixture(autouse=True)
+def db(monkeypatch):
+    monkeypatch.setattr(cache_db, 'db', sqlite3.connect(':memory:', check_same_thread=False))
+
+
+def keys():
+    return sorted(row[:3] for row in cache_db.query("SELECT kind, full_name, path FROM file_index"))
+
+
+def test_init_evicts_other_kinds_and_entries_not_found_for_the_ttl():
+    file_index.init('images:v3')
+    file_index.put_images('images:v2', 'org/a', 'Dockerfile', 'sha', [])
+    file_index.put_images('images:v3', 'org/a', 'Dockerfile', 'sha', [])
+    file_index.put_images('images:v3', 'org/deleted', 'Dockerfile', 'sha', [])
+    cache_db.execute("UPDATE file_index SET updated_at = ? WHERE full_name = 'org/deleted'",
+                     (time.time() - file_index.CACHE_TTL - 1,))
+    file_index.init('images:v3')
+    assert keys() == [('images:v3', 'org/a', 'Dockerfile')]
+
+
+def test_reused_entries_are_kept():
+    file_index.init('images:v3')
+    file_index.put_images('images:v3', 'org/a', 'Dockerfile', 'sha', [["N/A", "node", "node", "14", "No"]])
+    old = time.time() - file_index.CACHE_TTL + 60
+    cache_db.execute("UPDATE file_index SET updated_at = ?", (old,))
+    assert file_index.get_images('images:v3', 'org/a', 'Dockerfile', 'sha') == [["N/A", "node", "node", "14", "No"]]
+    assert file_index.get_images('images:v3', 'org/a', 'Dockerfile', 'changed') is None
+    file_index.touch_reused()
+    assert cache_db.query("SELECT updated_at FROM file_index")[0][0] > old + 60
+    assert file_index.stats == {'hits': 1, 'misses': 1}
@@ -0,0 +1,30 @@
+import pytest
+
+from query_partitioner import MAX_SPLIT, MAX_FILE_SIZE, size_ranges
+
+
+@pytest.mark.parametrize('low, high, total, count', [
+    (0, MAX_FILE_SIZE, 1500, 2),
+    (0, MAX_FILE_SIZE, 4500, 5),
+    (0, MAX_FILE_SIZE, 100000, MAX_SPLIT),
+    # Never more ranges than sizes
+    (10, 12, 50000, 3),
+    (10, 11, 50000, 2),
+    (1000, 2000, 3000, 3),
+])
+def test_size_ranges(low, high, total, count):
+    ranges = size_ranges(low, high, total)
+    assert len(ranges) == count
+    # Consecutive ranges covering low..high
+    assert ranges[0][0] == low
+    assert ranges[-1][1] == high
+    for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+        assert start <= end
+        assert next_start == end + 1
+
+
+def test_size_ranges_log_scale():
+    # Most Dockerfiles are a few KB, the ranges get wider with the size
+    widths = [end - start for start, end in size_ranges(0, MAX_FILE_SIZE, 8000)]
+    assert widths == sorted(widths)
+    assert widths[0] < 10
@@ -0,0 +1,46 @@
+import datetime
+import os
+
+import pytest
+
+import row_sink
+
+pytest.importorskip('pyarrow')
+import pyarrow.parquet  # noqa: E402
+
+
+def row(date, i):
+    return [date.strftime('%m-%d-%Y'), 'Synthetic Org', f"repo-{i}", 'Dockerfile', 'N/A', 'python', 'python', '3.9',
+            f"https://github.com/synthetic-org/repo-{i}", 'No', 'None']
+
+
+def test_ordered_writes_every_date_out_when_the_next_one_starts(tmp_path):
+    sink = row_sink.ParquetSink(str(tmp_path), 'export', ordered=True)
+    start = datetime.date(2021, 8, 1)
+    dates = [start + datetime.timedelta(days=day) for day in range(28)]
+    for day, date in enumerate(dates):
+        for i in range(100):
+            sink.add_row(row(date, i))
+        # Only the date being written is held in memory, the earlier ones are files already
+        assert list(sink.buffers) == [date]
+        assert len(sink.paths) == day
+    sink.close()
+    assert sink.rows == 2800
+    assert not sink.buffers and not sink.writers
+    assert [os.path.basename(os.path.dirname(path)) for path in sink.paths] == \
+        [f"day={date.isoformat()}" for date in dates]
+    for date, path in zip(dates, sink.paths):
+        table = pyarrow.parquet.read_table(path)
+        assert table.num_rows == 100
+        assert set(table.column('Date').to_pylist()) == {date}
+
+
+def test_unordered_keeps_the_dates_until_close(tmp_path):
+    sink = row_sink.ParquetSink(str(tmp_path), 'run')
+    dates = [datetime.date(2021, 8, 1), datetime.date(2021, 8, 2)]
+    for i in range(10):
+        sink.add_row(row(dates[i % 2], i))
+    assert sorted(sink.buffers) == dates
+    assert sink.paths == []
+    sink.close()
+    assert sorted(pyarrow.parquet.read_table(path).num_rows for path in sink.paths) == [5, 5]
@@ -0,0 +1,34 @@
+import pytest
+
+import scan_engine
+
+ARTIFACTORY = 'redventures-container-pipeline-docker.jfrog.io'
+ECR = '089022728777.dkr.ecr.us-east-1.amazonaws.com'
+
+
+@pytest.mark.parametrize('content, expected', [
+    ("FROM python:3.9-slim\n", [["N/A", "python", "python", "3.9-slim", "No"]]),
+    ("FROM node\n", [["N/A", "node", "node", "latest", "No"]]),
+    ("FROM python@sha256:3f1a2b\n", [["N/A", "python", "python", "sha256:3f1a2b", "No"]]),
+    # Images that match none of image_lang_list
+    ("FROM nginx:1.21\nFROM ubuntu:20.04\n", []),
+    # java, jdk and jre images are java, jdk also inside a word
+    ("FROM openjdk:11-jre\n", [["N/A", "openjdk", "java", "11-jre", "No"]]),
+    ("FROM eclipse-temurin:17-jre\n", []),
+    ("FROM maven-jre:3\n", [["N/A", "maven-jre", "java", "3", "No"]]),
+    ("FROM javascript-runner:1\n", []),
+    ("FROM jrebel/agent:1\n", []),
+    ("FROM node-javascript:1\n", [["N/A", "node-javascript", "node", "1", "No"]]),
+    # php images are often alpine based
+    ("FROM php:7.4-fpm-alpine\n", [["N/A", "php", "php", "7.4-fpm-alpine", "No"]]),
+    ("FROM mcr.microsoft.com/dotnet/aspnet:5.0\n",
+     [["N/A", "mcr.microsoft.com/dotnet/aspnet", "dotnet", "5.0", "No"]]),
+    # Pipeline registries
+    (f"FROM {ARTIFACTORY}/rv-python-3.8:1.4.2\n", [["Artifactory", "rv-python-3.8", "python", "1.4.2", "Yes"]]),
+    (f"FROM {ECR}/rv-node-14:2.0.1\n", [["ECR", "rv-node-14", "node", "2.0.1", "Yes"]]),
+    ("FROM gcr.io/rv-base-images/golang:1.16\n", [["GCR", "golang", "golang", "1.16", "Yes"]]),
+    # The same image twice is a single row, build stages are left out
+    ("FROM node:14 AS build\nFROM node:14\nFROM build\n", [["N/A", "node", "node", "14", "No"]]),
+])
+def test_classify_images(content, expected):
+    assert scan_engine.classify_images(content) == expected